@@ -3,13 +3,26 @@ import json
 import os
 import uuid
 import logging
-from typing import Dict
+from datetime import datetime
+from typing import Dict, Optional
 
 import boto3
 import srelogging
-from nsg_checker.message_dispatcher import MessageDispatcher
+from nsg_checker.message_dispatcher import MessageDispatcher, ProviderResult
 from botocore.exceptions import ClientError
 from nsg_checker.azure_nsg_checker import AzureNSGChecker
+from nsg_checker.cidr_history import CidrHistoryStore
+from nsg_checker.ip_rule_index import IpRuleIndex
+from nsg_checker.nsg_rule_cache import NsgRuleCache
+from nsg_checker.providers import (AwsIpRangesProvider, ProviderRegistry,
+                                   rule_prefixes)
+from nsg_checker.report_writer import JsonLinesReportWriter
+
+# Local copy of the state synced with STATE_BUCKET, /tmp is the only writable
+# path in Lambda
+STATE_DIRECTORY = "/tmp/nsg-checker-state"
+# Reports are uploaded as they are written and never downloaded again
+REPORT_DIRECTORY = "/tmp/nsg-checker-reports"
 
 
 def run(event, context):
@@ -22,24 +35,233 @@ def run(event, context):
     gsuite_netblocks = os.environ["GSUITE_NETBLOCKS"].split(",")
     azure_credentials = get_secret(os.environ["AZURE_APP_SECRET_NAME"],
                                    os.environ["AWS_SECRET_REGION"])
+    rgp_name = os.environ["AZURE_NSG_RGP"]
+    nsg_name = os.environ["AZURE_NSG_NAME"]
+    state_bucket = os.environ.get("STATE_BUCKET")
+    state_prefix = os.environ.get("STATE_PREFIX", "azure-nsg-checker/")
     logging.debug("Successfully loaded all required environment variables.")
 
-    nsg_checker = AzureNSGChecker(azure_credentials, gsuite_netblocks,
-                                  o365_url)
+    downloaded = {}
+    if state_bucket:
+        downloaded = download_state(state_bucket, f"{state_prefix}state/",
+                                    STATE_DIRECTORY)
+
+    rule_cache = NsgRuleCache(
+        state_path("NSG_RULE_CACHE_PATH", "rule_cache.json"))
+    rule_index = IpRuleIndex(state_path("RULE_INDEX_PATH", "rule_index.json"))
+    nsg_checker = AzureNSGChecker(azure_credentials,
+                                  gsuite_netblocks,
+                                  o365_url,
+                                  rule_cache=rule_cache,
+                                  rule_index=rule_index)
 
-    o365_azure_result, gsuite_azure_result = nsg_checker.get_azure_nsg_rules(
-        os.environ["AZURE_NSG_RGP"], os.environ["AZURE_NSG_NAME"])
+    registry = create_provider_registry(nsg_checker)
+    provider_rules = nsg_checker.get_azure_nsg_provider_rules(
+        rgp_name, nsg_name, registry)
+    nsg_id = nsg_checker.nsg_id(rgp_name, nsg_name)
+    nsg_entry = rule_cache.get(nsg_id)
+    nsg_rules = nsg_entry.rules + nsg_entry.default_rules
+    rule_cache.save()
+    rule_index.save()
 
-    o365_rules = nsg_checker.get_o365_smtp_ipv4_cidrs()
-    gsuite_rules = nsg_checker.get_gsuite_smtp_ipv4_cidrs()
+    provider_cidrs = registry.fetch_all()
+    azure_cidrs = {
+        name: rule_prefixes(rules)
+        for name, rules in provider_rules.items()
+    }
 
-    dispatcher = MessageDispatcher(o365_rules, gsuite_rules, o365_azure_result,
-                                   gsuite_azure_result,
-                                   azure_credentials["slack_oauth"],
-                                   os.environ["SLACK_CHANNEL"])
+    # The Slack message is sent first, the artefacts below are only secondary
+    # and failing to write them must not lose the alert
+    dispatcher = MessageDispatcher([
+        ProviderResult(provider.name, provider.label, provider.description,
+                       provider_cidrs[provider.name],
+                       azure_cidrs[provider.name]) for provider in registry
+    ], azure_credentials["slack_oauth"], os.environ["SLACK_CHANNEL"])
 
     dispatcher.dispatch_slack_message()
 
+    report_path = os.environ.get("REPORT_PATH")
+    if state_bucket:
+        report_path = os.path.join(
+            REPORT_DIRECTORY, f"{datetime.utcnow():%Y%m%dT%H%M%SZ}.jsonl.gz")
+    if report_path:
+        try:
+            os.makedirs(os.path.dirname(report_path) or ".", exist_ok=True)
+            with JsonLinesReportWriter(report_path) as writer:
+                for provider in registry:
+                    writer.write_result(nsg_id, provider.name,
+                                        provider_cidrs[provider.name],
+                                        azure_cidrs[provider.name],
+                                        provider_rules[provider.name],
+                                        nsg_rules)
+            if state_bucket:
+                upload_report(state_bucket, f"{state_prefix}reports/",
+                              report_path)
+        except Exception as error:
+            logging.error(f"Unable to write report {report_path}: {error}")
+
+    history_path = state_path("CIDR_HISTORY_PATH", "history")
+    if history_path:
+        nsg_source = f"azure{nsg_id}"
+        fetched_cidrs = {
+            name: cidrs
+            for name, cidrs in provider_cidrs.items() if cidrs is not None
+        }
+        nsg_cidrs = {
+            f"{nsg_source}/{name}": cidrs
+            for name, cidrs in azure_cidrs.items()
+        }
+
+        try:
+            history = CidrHistoryStore(history_path)
+            record_history(history, fetched_cidrs)
+            record_history(history, nsg_cidrs, allow_empty=True)
+        except Exception as error:
+            logging.error(
+                f"Unable to record CIDR history in {history_path}: {error}")
+
+    if state_bucket:
+        try:
+            upload_state(state_bucket, f"{state_prefix}state/",
+                         STATE_DIRECTORY, downloaded)
+        except Exception as error:
+            logging.error(f"Unable to upload state: {error}")
+
+
+def state_path(env_name: str, state_name: str) -> Optional[str]:
+    """
+    Retrieves where a persisted artefact lives. With STATE_BUCKET set it is
+    kept in the local state directory that is synced with S3, otherwise it is
+    the path in env_name, which only persists for local or CLI runs.
+
+    Attributes:
+        env_name (str): Environment variable holding a local path.
+        state_name (str): Path of the artefact inside the state directory.
+
+    Returns:
+        The path, or None if the artefact is not enabled.
+    """
+
+    if os.environ.get("STATE_BUCKET"):
+        return os.path.join(STATE_DIRECTORY, state_name)
+    return os.environ.get(env_name)
+
+
+def download_state(bucket: str, prefix: str,
+                   directory: str) -> Dict[str, float]:
+    """
+    Downloads the persisted artefacts of previous runs from S3.
+
+    Attributes:
+        bucket (str): The S3 bucket holding the state.
+        prefix (str): Key prefix of the state in the bucket.
+        directory (str): Local directory to download the state into.
+
+    Returns:
+        The modification time of each downloaded file keyed by its path.
+    """
+
+    logging.info(f"Downloading state from s3://{bucket}/{prefix}")
+    os.makedirs(directory, exist_ok=True)
+    client = boto3.session.Session().client("s3")
+    paginator = client.get_paginator("list_objects_v2")
+    downloaded = {}
+
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for item in page.get("Contents", []):
+            path = os.path.join(directory, item["Key"][len(prefix):])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            client.download_file(bucket, item["Key"], path)
+            downloaded[path] = os.path.getmtime(path)
+
+    return downloaded
+
+
+def upload_state(bucket: str, prefix: str, directory: str,
+                 downloaded: Dict[str, float]) -> None:
+    """
+    Uploads the artefacts created or changed during this run to S3.
+
+    Attributes:
+        bucket (str): The S3 bucket holding the state.
+        prefix (str): Key prefix of the state in the bucket.
+        directory (str): Local directory holding the state.
+        downloaded (Dict): Modification times returned by download_state, unchanged files are skipped.
+    """
+
+    logging.info(f"Uploading state to s3://{bucket}/{prefix}")
+    client = boto3.session.Session().client("s3")
+
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            if downloaded.get(path) != os.path.getmtime(path):
+                key = prefix + os.path.relpath(path, directory).replace(
+                    os.sep, "/")
+                client.upload_file(path, bucket, key)
+
+
+def upload_report(bucket: str, prefix: str, path: str) -> None:
+    """
+    Uploads a report to S3 and removes the local copy, so reports do not
+    accumulate in /tmp across the invocations of a warm container.
+
+    Attributes:
+        bucket (str): The S3 bucket holding the reports.
+        prefix (str): Key prefix of the reports in the bucket.
+        path (str): Local path of the report.
+    """
+
+    key = prefix + os.path.basename(path)
+    logging.info(f"Uploading report to s3://{bucket}/{key}")
+    client = boto3.session.Session().client("s3")
+    client.upload_file(path, bucket, key)
+    os.remove(path)
+
+
+def create_provider_registry(nsg_checker: AzureNSGChecker) -> ProviderRegistry:
+    """
+    Creates the registry of providers to check. O365 and GSUITE are always
+    checked, AWS is checked when AWS_IP_RANGES_SERVICES is set.
+
+    Attributes:
+        nsg_checker (AzureNSGChecker): Checker used to retrieve O365 and GSUITE CIDRs.
+
+    Returns:
+        The ProviderRegistry.
+    """
+
+    registry = nsg_checker.default_registry(os.environ.get("O365_RULE_TAG"),
+                                            os.environ.get("GSUITE_RULE_TAG"))
+
+    if os.environ.get("AWS_IP_RANGES_SERVICES"):
+        regions = os.environ.get("AWS_IP_RANGES_REGIONS")
+        registry.register(
+            AwsIpRangesProvider(
+                regions=regions.split(",") if regions else None,
+                services=os.environ["AWS_IP_RANGES_SERVICES"].split(","),
+                tag=os.environ.get("AWS_RULE_TAG")))
+
+    return registry
+
+
+def record_history(store: CidrHistoryStore,
+                   snapshots: Dict,
+                   allow_empty: bool = False) -> None:
+    """
+    Records the CIDR sets retrieved during this run in the history store.
+
+    Attributes:
+        store (CidrHistoryStore): The history store to append to.
+        snapshots (Dict): CIDR sets keyed by their source name.
+        allow_empty (bool): Record empty sets over non-empty history.
+    """
+
+    logging.info(f"Recording CIDR history in {store.root}")
+
+    for source, cidrs in snapshots.items():
+        store.record(source, cidrs, allow_empty=allow_empty)
+
 
 def get_secret(secret_name: str, region_name: str) -> Dict:
     """
@@ -0,0 +1,92 @@
+"""
+Command line interface for querying the artefacts written by the checker.
+
+Usage:
+    python -m nsg_checker lookup --index rule_index.json 40.92.1.1 104.47.0.0/17
+    python -m nsg_checker lookup --index rule_index.json --direction any 10.0.0.4
+"""
+
+import argparse
+import os
+import sys
+from typing import Dict, List
+
+from nsg_checker.ip_rule_index import IpRuleIndex
+
+
+def lookup(args: argparse.Namespace) -> int:
+    """
+    Prints the NSG rules that match each address given, followed by the rules
+    whose service tag source is not indexed and so could not be evaluated.
+
+    Arguments:
+        args (Namespace): Parsed arguments with the index path, direction and addresses.
+
+    Returns:
+        0 if every address matched a rule, 1 if an address matched none or
+        was not an IP address or CIDR.
+    """
+    index = IpRuleIndex(args.index)
+    direction = None if args.direction == "any" else args.direction
+    skipped = index.skipped(direction)
+    exit_code = 0
+
+    for address in args.addresses:
+        try:
+            matches = index.lookup(address, direction)
+        except ValueError:
+            print(f"{address}\tnot an IP address or CIDR", file=sys.stderr)
+            exit_code = 1
+            continue
+
+        if not matches:
+            print(f"{address}\tno matching rules")
+            exit_code = 1
+
+        for match in matches:
+            print("\t".join([address] + _columns(match)))
+        for entry in skipped:
+            print("\t".join([address] + _columns(entry) + ["not evaluated"]))
+
+    return exit_code
+
+
+def _columns(entry: Dict) -> List[str]:
+    return [
+        entry["nsg"], entry["rule"],
+        str(entry["priority"]),
+        str(entry["access"]),
+        str(entry["direction"]),
+        entry.get("service_tag") or entry["prefix"],
+        ",".join(entry["ports"])
+    ]
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog="nsg_checker")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    lookup_parser = subparsers.add_parser(
+        "lookup", help="Find the NSG rules that admit or drop an IP or CIDR.")
+    lookup_parser.add_argument("--index",
+                               required=True,
+                               help="Path of the rule index JSON file.")
+    lookup_parser.add_argument(
+        "--direction",
+        choices=["Inbound", "Outbound", "any"],
+        default="Inbound",
+        help="Only show rules of this direction (default: Inbound).")
+    lookup_parser.add_argument("addresses",
+                               nargs="+",
+                               help="IP addresses or CIDRs to look up.")
+    lookup_parser.set_defaults(handler=lookup)
+
+    args = parser.parse_args(argv)
+    if args.command == "lookup" and not os.path.exists(args.index):
+        lookup_parser.error(f"rule index {args.index} does not exist")
+
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
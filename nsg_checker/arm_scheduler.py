@@ -0,0 +1,296 @@
+"""ArmRequestScheduler
+
+Schedules Azure Resource Manager calls so that they stay within the ARM
+throttling limits. Requests draw from a token bucket per subscription and per
+tenant. The buckets adapt to the ``x-ms-ratelimit-remaining-*`` headers on
+every response, back off when a 429 is returned and honour ``Retry-After``.
+A 304 answer to a conditional read is a successful call and returns
+``NOT_MODIFIED`` instead of raising.
+"""
+
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Mapping, Optional, Tuple
+
+RATELIMIT_HEADER_PREFIX = "x-ms-ratelimit-remaining-"
+THROTTLED_STATUS_CODE = 429
+NOT_MODIFIED_STATUS_CODE = 304
+
+# Returned by ArmRequestScheduler.call when a conditional read answers 304
+NOT_MODIFIED = object()
+
+# ARM refills 25 subscription read tokens per second up to a bucket of 250
+DEFAULT_RATE = 25.0
+DEFAULT_CAPACITY = 250
+# Lowest rate throttling can halve down to, and the rate regained per success
+DEFAULT_MIN_RATE = 0.25
+DEFAULT_RATE_INCREASE = 0.5
+
+
+class TokenBucket:
+    def __init__(self,
+                 rate: float,
+                 capacity: int,
+                 min_rate: float = DEFAULT_MIN_RATE,
+                 rate_increase: float = DEFAULT_RATE_INCREASE,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        """
+        Token bucket whose refill rate grows additively while requests succeed
+        and halves whenever the service throttles.
+
+        Attributes:
+            rate (float): Current refill rate in tokens per second.
+            max_rate (float): The highest refill rate the bucket will grow to.
+            min_rate (float): The lowest refill rate throttling will halve to.
+            rate_increase (float): Refill rate regained per successful request.
+            capacity (int): Maximum number of tokens held.
+            tokens (float): Tokens currently available, negative when reserved ahead.
+            paused_until (float): Clock time before which no request may start.
+
+        Args:
+            rate (float): Refill rate in tokens per second.
+            capacity (int): Maximum number of tokens held.
+            min_rate (float): The lowest refill rate throttling will halve to.
+            rate_increase (float): Refill rate regained per successful request.
+            clock (Callable): Monotonic clock returning seconds.
+        """
+        self.rate = rate
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate_increase = rate_increase
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.paused_until = 0.0
+        self._clock = clock
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Takes a token from the bucket.
+
+        Returns:
+            The number of seconds the caller must wait before using the token.
+        """
+        with self._lock:
+            now = self._refill()
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def observe_remaining(self, remaining: int) -> None:
+        """Caps the available tokens at the quota ARM reports as remaining."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, float(remaining))
+
+    def succeeded(self) -> None:
+        """Additively raises the refill rate back towards its maximum."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.rate_increase)
+
+    def throttled(self, retry_after: float) -> None:
+        """Empties the bucket, halves the refill rate and pauses all requests
+           for retry_after seconds."""
+        with self._lock:
+            now = self._refill()
+            self.tokens = min(self.tokens, 0.0)
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.paused_until = max(self.paused_until, now + retry_after)
+
+    def _refill(self) -> float:
+        now = self._clock()
+        self.tokens = min(float(self.capacity),
+                          self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return now
+
+
+class ArmRequestScheduler:
+    def __init__(self,
+                 tenant_id: str,
+                 subscription_id: str,
+                 rate: float = DEFAULT_RATE,
+                 capacity: int = DEFAULT_CAPACITY,
+                 min_rate: float = DEFAULT_MIN_RATE,
+                 rate_increase: float = DEFAULT_RATE_INCREASE,
+                 max_retries: int = 5,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep,
+                 wall_clock: Callable[[], float] = time.time) -> None:
+        """
+        Runs Azure management operations through per subscription and per
+        tenant token buckets. One scheduler can be shared by every checker
+        in a fleet scan.
+
+        Attributes:
+            tenant_id (str): Default tenant the calls are made in.
+            subscription_id (str): Default subscription the calls are made in.
+            max_retries (int): How many times a throttled call is retried.
+
+        Args:
+            tenant_id (str): Default tenant the calls are made in.
+            subscription_id (str): Default subscription the calls are made in.
+            rate (float): Starting and maximum requests per second per bucket.
+            capacity (int): Burst size of each bucket.
+            min_rate (float): The lowest rate throttling will halve a bucket to.
+            rate_increase (float): Rate regained by a bucket per successful request.
+            max_retries (int): How many times a throttled call is retried.
+            clock (Callable): Monotonic clock returning seconds.
+            sleep (Callable): Function used to wait for the given seconds.
+            wall_clock (Callable): Clock returning epoch seconds, used for
+                HTTP date Retry-After headers.
+        """
+        self.tenant_id = tenant_id
+        self.subscription_id = subscription_id
+        self.max_retries = max_retries
+        self._rate = rate
+        self._capacity = capacity
+        self._min_rate = min_rate
+        self._rate_increase = rate_increase
+        self._clock = clock
+        self._sleep = sleep
+        self._wall_clock = wall_clock
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def call(self,
+             operation: Callable,
+             *args,
+             subscription_id: str = None,
+             tenant_id: str = None,
+             **kwargs):
+        """Calls an Azure SDK operation once both of its buckets allow it.
+
+        The operation is called with raw=True so the rate limit headers of
+        the response can be read. The SDK raises on a 304 answer to a
+        conditional read, which is treated as a success.
+
+        Arguments:
+            operation (Callable): The SDK operation, e.g. network_security_groups.get.
+            subscription_id (str): Subscription of the call, defaults to the scheduler's.
+            tenant_id (str): Tenant of the call, defaults to the scheduler's.
+
+        Raises:
+            The operation's error if it is not throttling or retries are exhausted.
+
+        Returns:
+            The deserialised output of the operation, or NOT_MODIFIED.
+        """
+        buckets = {
+            "subscription":
+            self.bucket("subscription", subscription_id
+                        or self.subscription_id),
+            "tenant":
+            self.bucket("tenant", tenant_id or self.tenant_id)
+        }
+
+        for attempt in range(self.max_retries + 1):
+            wait = max(bucket.reserve() for bucket in buckets.values())
+            if wait > 0:
+                logging.debug(f"Waiting {wait:.2f}s for ARM request quota.")
+                self._sleep(wait)
+
+            try:
+                raw_response = operation(*args, raw=True, **kwargs)
+            except Exception as error:
+                headers = _headers_of(getattr(error, "response", None))
+                if status_code_of(error) == NOT_MODIFIED_STATUS_CODE:
+                    self._observe(buckets, headers)
+                    return NOT_MODIFIED
+                if (status_code_of(error) != THROTTLED_STATUS_CODE
+                        or attempt == self.max_retries):
+                    raise
+
+                retry_after = _retry_after(headers, 2**attempt,
+                                           self._wall_clock())
+                logging.warning(
+                    f"ARM throttled the request, retrying in {retry_after}s.")
+                for bucket in buckets.values():
+                    bucket.throttled(retry_after)
+                continue
+
+            headers = _headers_of(getattr(raw_response, "response", None))
+            self._observe(buckets, headers)
+            return getattr(raw_response, "output", raw_response)
+
+    def bucket(self, scope: str, scope_id: str) -> TokenBucket:
+        """Retrieves the token bucket of a subscription or tenant, creating
+           it on first use.
+
+        Arguments:
+            scope (str): Either "subscription" or "tenant".
+            scope_id (str): The ID of the subscription or tenant.
+
+        Returns:
+            The shared TokenBucket for the scope.
+        """
+        with self._lock:
+            key = (scope, scope_id)
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(self._rate, self._capacity,
+                                                 self._min_rate,
+                                                 self._rate_increase,
+                                                 self._clock)
+            return self._buckets[key]
+
+    def _observe(self, buckets: Dict[str, TokenBucket],
+                 headers: Mapping[str, str]) -> None:
+        remaining: Dict[str, int] = {}
+
+        for name, value in headers.items():
+            name = name.lower()
+            if not name.startswith(RATELIMIT_HEADER_PREFIX):
+                continue
+            scope = name[len(RATELIMIT_HEADER_PREFIX):].split("-", 1)[0]
+            if scope in buckets and value.strip().isdigit():
+                remaining[scope] = min(int(value),
+                                       remaining.get(scope, int(value)))
+
+        for scope, bucket in buckets.items():
+            if scope in remaining:
+                bucket.observe_remaining(remaining[scope])
+            bucket.succeeded()
+
+
+def status_code_of(error: Exception) -> Optional[int]:
+    """Retrieves the HTTP status code of an Azure SDK error, if it has one.
+
+    Arguments:
+        error (Exception): The error raised by the SDK.
+
+    Returns:
+        The status code, or None if the error did not come from a response.
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code",
+                              None)
+    return status_code
+
+
+def _headers_of(response) -> Mapping[str, str]:
+    headers = getattr(response, "headers", None)
+    return headers if headers is not None else {}
+
+
+def _retry_after(headers: Mapping[str, str], default: float,
+                 now: float) -> float:
+    """Parses a Retry-After header given in seconds or as an HTTP date,
+       relative to now in epoch seconds."""
+    value = None
+    for name, header_value in headers.items():
+        if name.lower() == "retry-after":
+            value = header_value.strip()
+
+    if not value:
+        return float(default)
+    if value.isdigit():
+        return float(value)
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return float(default)
+    return max(0.0, retry_at.timestamp() - now)
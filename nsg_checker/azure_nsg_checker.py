@@ -7,6 +7,11 @@ Parameters:
     subscription (str): The subscription where the Azure NSG is located.
     gsuite_netblocks (List[str]): List of GSUITE netblocks.
     o365_url (str): The O365 URL for exchange endpoints.
+    scheduler (ArmRequestScheduler): Optional scheduler shared between checkers.
+    rule_cache (NsgRuleCache): Optional cache of parsed NSG rules keyed by ETag.
+    rule_index (IpRuleIndex): Optional reverse index updated with every NSG fetched.
+    registry (ProviderRegistry): Optional providers NSG rules are matched to,
+        defaults to O365 and GSUITE.
     
 
 Author:
@@ -25,20 +30,48 @@ import requests
 from azure.common.credentials import ServicePrincipalCredentials
 from azure.mgmt.network import NetworkManagementClient
 
+from nsg_checker.arm_scheduler import ArmRequestScheduler, NOT_MODIFIED
+from nsg_checker.ip_rule_index import IpRuleIndex
+from nsg_checker.nsg_rule_cache import NsgRuleCache, NsgRuleCacheEntry
+from nsg_checker.providers import (REQUEST_TIMEOUT, FunctionProvider,
+                                   ProviderFetchError, ProviderRegistry,
+                                   rule_prefixes)
+
 # IPv4 with CIDR Regex Pattern
 IPV4_PATTERN = r"(?:\d{1,3}\.){3}\d{1,3}(?:/\d\d?)?"
 
+# Security rule attributes kept in the rule cache
+RULE_LIST_FIELDS = ("destination_port_ranges", "source_address_prefixes")
+RULE_FIELDS = ("id", "name", "description", "priority", "access",
+               "direction", "destination_port_range", "source_address_prefix")
+
+NSG_ID_FORMAT = ("/subscriptions/{subscription_id}/resourceGroups/{rgp_name}"
+                 "/providers/Microsoft.Network/networkSecurityGroups/{nsg_name}")
+
 
 class AzureNSGChecker:
-    def __init__(self, azure_credentials: Dict, gsuite_netblocks: List[str],
-                 o365_url: str):
+    def __init__(self,
+                 azure_credentials: Dict,
+                 gsuite_netblocks: List[str],
+                 o365_url: str,
+                 scheduler: ArmRequestScheduler = None,
+                 rule_cache: NsgRuleCache = None,
+                 rule_index: IpRuleIndex = None,
+                 registry: ProviderRegistry = None):
         self.client = self._connect(azure_credentials["client_id"],
                                     azure_credentials["tenant_id"],
                                     azure_credentials["key"],
                                     azure_credentials["subscription_id"])
+        self.subscription_id = azure_credentials["subscription_id"]
+        self.rule_cache = rule_cache or NsgRuleCache()
+        self.rule_index = rule_index
 
         self.gsuite_netblocks = gsuite_netblocks
         self.o365_url = o365_url
+        self.scheduler = scheduler or ArmRequestScheduler(
+            azure_credentials["tenant_id"],
+            azure_credentials["subscription_id"])
+        self.registry = registry or self.default_registry()
 
     def _connect(self, client_id: str, tenant_id: str, key: str,
                  subscription: str) -> NetworkManagementClient:
@@ -67,10 +100,55 @@ class AzureNSGChecker:
 
         return client
 
+    def nsg_id(self, rgp_name: str, nsg_name: str) -> str:
+        """Builds the Azure resource ID of an NSG in the checker's subscription.
+
+        Arguments:
+            rgp_name (str): The resource group name that contains the NSG.
+            nsg_name (str): The name of the NSG inside the above rgp.
+
+        Returns:
+            The resource ID, used to key the rule cache, index, report and history.
+        """
+        return NSG_ID_FORMAT.format(subscription_id=self.subscription_id,
+                                    rgp_name=rgp_name,
+                                    nsg_name=nsg_name)
+
+    def default_registry(self,
+                         o365_tag: str = None,
+                         gsuite_tag: str = None) -> ProviderRegistry:
+        """Creates a registry of the O365 and GSUITE providers, whose CIDRs
+           are retrieved by this checker.
+
+        Arguments:
+            o365_tag (str): Tag of the O365 NSG rules, defaults to "o365".
+            gsuite_tag (str): Tag of the GSUITE NSG rules, defaults to "gsuite".
+
+        Returns:
+            The ProviderRegistry.
+        """
+        registry = ProviderRegistry()
+        registry.register(
+            FunctionProvider(
+                "o365",
+                "O365",
+                "O365 Exchange",
+                lambda: self.get_o365_smtp_ipv4_cidrs(strict=True),
+                tag=o365_tag))
+        registry.register(
+            FunctionProvider(
+                "gsuite",
+                "GSUITE",
+                "GSUITE Gmail",
+                lambda: self.get_gsuite_smtp_ipv4_cidrs(strict=True),
+                tag=gsuite_tag))
+
+        return registry
+
     def get_azure_nsg_rules(self, rgp_name: str,
                             nsg_name: str) -> Tuple[Set, Set]:
-        """Retrieves the Azure NSG rules with GSUITE and O365 in their name
-           and the SMTP Port 25.
+        """Retrieves the source prefixes of the Azure NSG rules tagged for
+           O365 and GSUITE that open the SMTP Port 25.
 
         Arguments:
             rgp_name (str): The resource group name that contains the NSG.
@@ -80,42 +158,113 @@ class AzureNSGChecker:
             Tuple (Set,Set): Two sets, first O365 rules found in the Azure NSG
             and a second set of GSUITE rules found in the Azure NSG.
         """
+        provider_rules = self.get_azure_nsg_provider_rules(rgp_name, nsg_name)
+
+        return (rule_prefixes(provider_rules.get("o365", [])),
+                rule_prefixes(provider_rules.get("gsuite", [])))
+
+    def get_azure_nsg_provider_rules(
+            self,
+            rgp_name: str,
+            nsg_name: str,
+            registry: ProviderRegistry = None) -> Dict[str, List[Dict]]:
+        """Retrieves the Azure NSG rules of every registered provider, matched
+           by the provider's tag.
+
+        Arguments:
+            rgp_name (str): The resource group name that contains the NSG.
+            nsg_name (str): The name of the NSG inside the above rgp.
+            registry (ProviderRegistry): The providers to match rules to,
+                defaults to the checker's registry.
+
+        Returns:
+            Dict: The rules of each provider keyed by provider name.
+        """
+        registry = registry or self.registry
+        entry = self.get_azure_nsg_rule_entry(rgp_name, nsg_name)
+
+        return entry.derived_value(f"provider_rules:{registry.signature()}",
+                                   lambda: registry.classify(entry.rules))
+
+    def get_azure_nsg_rule_entry(self, rgp_name: str,
+                                 nsg_name: str) -> NsgRuleCacheEntry:
+        """Retrieves the parsed rules of an Azure NSG, only parsing them again
+           when the NSG's ETag has changed since they were cached.
+
+        Arguments:
+            rgp_name (str): The resource group name that contains the NSG.
+            nsg_name (str): The name of the NSG inside the above rgp.
+
+        Returns:
+            NsgRuleCacheEntry: The ETag and rules of the NSG.
+        """
+        entry = self._fetch_azure_nsg_rule_entry(rgp_name, nsg_name)
+
+        if self.rule_index is not None:
+            self.rule_index.update_nsg(self.nsg_id(rgp_name, nsg_name),
+                                       entry.etag, entry.rules,
+                                       entry.default_rules)
+
+        return entry
+
+    def _fetch_azure_nsg_rule_entry(self, rgp_name: str,
+                                    nsg_name: str) -> NsgRuleCacheEntry:
         logging.info(f"Retriving NSG rules for nsg {nsg_name} ")
-        azure_result = self.client.network_security_groups.get(
-            rgp_name, nsg_name)
-        o365_result = set()
-        gsuite_result = set()
-
-        for rule in azure_result.security_rules:
-            if "25" in rule.destination_port_ranges:
-                if "gsuite" in rule.name.lower():
-                    gsuite_result.update(rule.source_address_prefixes)
-                elif "o365" in rule.name.lower():
-                    o365_result.update(rule.source_address_prefixes)
+        nsg_id = self.nsg_id(rgp_name, nsg_name)
+        cached = self.rule_cache.get(nsg_id)
+        custom_headers = {
+            "If-None-Match": cached.etag
+        } if cached is not None and cached.etag else None
+
+        azure_result = self.scheduler.call(
+            self.client.network_security_groups.get,
+            rgp_name,
+            nsg_name,
+            custom_headers=custom_headers)
+        if azure_result is NOT_MODIFIED and cached is not None:
+            logging.info(f"NSG {nsg_name} not modified, using cached rules")
+            return cached
+
+        etag = getattr(azure_result, "etag", None)
+        if cached is not None and etag and etag == cached.etag:
+            logging.info(f"NSG {nsg_name} ETag unchanged, using cached rules")
+            return cached
+
+        rules = [_rule_to_dict(rule) for rule in azure_result.security_rules]
+        default_rules = [
+            _rule_to_dict(rule)
+            for rule in getattr(azure_result, "default_security_rules", None)
+            or []
+        ]
 
         logging.info(f"Successfully retrieving NSG rules for {nsg_name}")
-        logging.debug(f"O365 Rules found: {o365_result}")
-        logging.debug(f"GSUITE Rules found: {gsuite_result}")
 
-        return (o365_result, gsuite_result)
+        return self.rule_cache.put(nsg_id, etag, rules, default_rules)
 
-    def get_o365_smtp_ipv4_cidrs(self) -> Set:
+    def get_o365_smtp_ipv4_cidrs(self, strict: bool = False) -> Set:
         """Retrieves the current Office 365 Exchange SMTP egress CIDR IPv4s
            addresses in a set.
 
            Contacts the outlook endpoint and retrieves all SMTP 25 IPv4 addresses.
 
+           Arguments:
+                strict (bool): Raise instead of returning an empty set on failure.
+
+           Raises:
+                ProviderFetchError if strict and the endpoint did not return 200.
+
            Returns:
                 Set of O365 IPv4 CIDR.
         """
         logging.info(f"Retrieving exchange IPv4 CIDRS from {self.o365_url}")
-        response = requests.get(self.o365_url)
+        response = requests.get(self.o365_url, timeout=REQUEST_TIMEOUT)
         ipv4_addresses = set()
 
         if response.status_code != 200:
-            logging.error(
-                f"{response.status_code} returned by O365. No O365 rules retrieved."
-            )
+            message = f"{response.status_code} returned by O365. No O365 rules retrieved."
+            if strict:
+                raise ProviderFetchError(message)
+            logging.error(message)
             return ipv4_addresses
 
         logging.info("Successfully retrieved O365 exchange IPv4 addresses.")
@@ -132,16 +281,23 @@ class AzureNSGChecker:
         logging.debug(f"O365 IPv4 CIDR addresses found: {ipv4_addresses}.")
         return ipv4_addresses
 
-    def get_gsuite_smtp_ipv4_cidrs(self) -> Set:
+    def get_gsuite_smtp_ipv4_cidrs(self, strict: bool = False) -> Set:
         """Retrieves the current GSUITE SMTP egress CIDR IPv4s 
            addresses in the format of a set.
 
+           Arguments:
+              strict (bool): Raise instead of returning a partial set on failure.
+
+           Raises:
+              ProviderFetchError if strict and any netblock lookup failed.
+
            Returns:
               Set of GSUITE IPv4 egress CIDR IPs.
 
         """
         pat = re.compile(IPV4_PATTERN)
         ipv4_addresses = set()
+        failed_netblocks = []
 
         for netblock in self.gsuite_netblocks:
             try:
@@ -155,13 +311,31 @@ class AzureNSGChecker:
 
             except dns.resolver.NXDOMAIN:
                 logging.error(f"Unable to resolve: {netblock}")
+                failed_netblocks.append(netblock)
             except dns.resolver.Timeout:
                 logging.error(f"Timeout trying to resolve: {netblock}")
+                failed_netblocks.append(netblock)
             except dns.resolver.NoNameservers:
                 logging.warning(f"No nameserver to resolve: {netblock}")
+                failed_netblocks.append(netblock)
             except dns.resolver.NoAnswer:
                 logging.error(f"No dns answer: {netblock}")
+                failed_netblocks.append(netblock)
+
+        if strict and failed_netblocks:
+            raise ProviderFetchError(
+                f"Unable to resolve GSUITE netblocks: {failed_netblocks}")
 
         logging.debug(f"GSUITE IPv4 CIDR addresses found: {ipv4_addresses}.")
 
         return ipv4_addresses
+
+
+def _rule_to_dict(rule) -> Dict:
+    """Copies the attributes of an NSG security rule used by the checker into
+       a JSON serialisable dictionary."""
+    result = {field: getattr(rule, field, None) for field in RULE_FIELDS}
+    for field in RULE_LIST_FIELDS:
+        result[field] = list(getattr(rule, field, None) or [])
+
+    return result
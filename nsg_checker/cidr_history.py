@@ -0,0 +1,295 @@
+"""CidrHistoryStore
+
+Append-only history of the CIDR sets retrieved on each run, so that questions
+such as "when did this range appear" can be answered without archived data.
+
+Each source (e.g. "o365", "gsuite" or an Azure NSG) is stored as two files,
+named by the SHA-256 hash of the source name:
+
+    <hash>.jsonl    One record per snapshot holding the added and removed
+                    CIDRs since the previous snapshot. Every
+                    ``checkpoint_interval`` records also hold the full state.
+    <hash>.idx      One line per snapshot with its timestamp, byte offset
+                    into the ``.jsonl`` file and whether it is a checkpoint.
+
+Hashing keeps file names short however long the source name is, e.g. the
+resource ID of an NSG. ``sources.jsonl`` maps the hashes back to the source
+names.
+
+The index is loaded once per source, so point-in-time queries bisect on the
+timestamps, seek to the nearest checkpoint and only apply the deltas after it.
+"""
+
+import bisect
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+# Lists the name of every source with recorded history
+MANIFEST_NAME = "sources.jsonl"
+
+
+class _SourceIndex:
+    """In-memory copy of a source's ``.idx`` file."""
+    def __init__(self) -> None:
+        self.timestamps: List[datetime] = []
+        self.offsets: List[int] = []
+        self.checkpoints: List[int] = []
+        self.latest: Optional[Set[str]] = None
+
+
+class CidrHistoryStore:
+    def __init__(self, root: str, checkpoint_interval: int = 50) -> None:
+        """
+        Delta encoded, append-only store of CIDR set snapshots.
+
+        Attributes:
+            root (str): Directory the history files are written to.
+            checkpoint_interval (int): Number of snapshots between full state checkpoints.
+
+        Args:
+            root (str): Directory the history files are written to.
+            checkpoint_interval (int): Number of snapshots between full state checkpoints.
+        """
+        if checkpoint_interval < 1:
+            raise ValueError("checkpoint_interval must be at least 1")
+
+        self.root = root
+        self.checkpoint_interval = checkpoint_interval
+        self._indexes: Dict[str, _SourceIndex] = {}
+        self._sources: Optional[Set[str]] = None
+        os.makedirs(root, exist_ok=True)
+
+    def record(self,
+               source: str,
+               cidrs: Set[str],
+               timestamp: datetime = None,
+               allow_empty: bool = False) -> bool:
+        """Appends a snapshot of a CIDR set to the history of a source.
+
+        Snapshots identical to the latest stored state are not written. An
+        empty snapshot over a non-empty state is refused unless allow_empty is
+        set, as it usually means the fetch failed rather than every range
+        being withdrawn.
+
+        Arguments:
+            source (str): Name of the source the CIDRs came from.
+            cidrs (set(str)): The CIDRs retrieved for the source.
+            timestamp (datetime): When the CIDRs were retrieved, defaults to now.
+            allow_empty (bool): Record an empty set over a non-empty state.
+
+        Raises:
+            ValueError if the timestamp is older than the latest snapshot.
+
+        Returns:
+            True if a snapshot was written, False if nothing had changed or
+            an empty snapshot was refused.
+        """
+        timestamp = _normalise(timestamp or datetime.now(timezone.utc))
+        index = self._load_index(source)
+
+        if index.timestamps and timestamp < index.timestamps[-1]:
+            raise ValueError(
+                f"Snapshot for {source} at {timestamp.isoformat()} is older than "
+                f"the latest snapshot at {index.timestamps[-1].isoformat()}")
+
+        previous = self._latest_state(source, index)
+        current = set(cidrs)
+        added = current - previous
+        removed = previous - current
+
+        if not current and previous and not allow_empty:
+            logging.warning(
+                f"Refusing to record an empty snapshot over {len(previous)} "
+                f"CIDRs for {source}.")
+            return False
+
+        if index.timestamps and not added and not removed:
+            logging.debug(f"No CIDR changes for {source}, snapshot skipped.")
+            return False
+
+        position = len(index.timestamps)
+        is_checkpoint = position % self.checkpoint_interval == 0
+        record = {
+            "timestamp": timestamp.isoformat(),
+            "added": sorted(added),
+            "removed": sorted(removed)
+        }
+        if is_checkpoint:
+            record["state"] = sorted(current)
+
+        self._add_source(source)
+        data_path, index_path = self._paths(source)
+        with open(data_path, "ab") as data_file:
+            offset = data_file.tell()
+            data_file.write((json.dumps(record) + "\n").encode("utf-8"))
+
+        with open(index_path, "a") as index_file:
+            index_file.write(
+                json.dumps({
+                    "timestamp": record["timestamp"],
+                    "offset": offset,
+                    "checkpoint": is_checkpoint
+                }) + "\n")
+
+        index.timestamps.append(timestamp)
+        index.offsets.append(offset)
+        if is_checkpoint:
+            index.checkpoints.append(position)
+        index.latest = current
+
+        logging.info(
+            f"Recorded {len(added)} added and {len(removed)} removed CIDRs for {source}"
+        )
+        return True
+
+    def state_at(self, source: str, timestamp: datetime) -> Set[str]:
+        """Retrieves the CIDR set of a source as it was at a point in time.
+
+        Arguments:
+            source (str): Name of the source.
+            timestamp (datetime): The point in time to query.
+
+        Returns:
+            The set of CIDRs, empty if nothing was recorded before the timestamp.
+        """
+        index = self._load_index(source)
+        position = bisect.bisect_right(index.timestamps,
+                                       _normalise(timestamp)) - 1
+        return self._state_at_position(source, index, position)
+
+    def diff(self, source: str, start: datetime,
+             end: datetime) -> Tuple[Set[str], Set[str]]:
+        """Calculates the net change of a source between two points in time.
+
+        Arguments:
+            source (str): Name of the source.
+            start (datetime): The earlier point in time.
+            end (datetime): The later point in time.
+
+        Returns:
+            Tuple (Set,Set): CIDRs added and CIDRs removed between start and end.
+        """
+        before = self.state_at(source, start)
+        after = self.state_at(source, end)
+
+        return (after - before, before - after)
+
+    def changes(self, source: str, start: datetime,
+                end: datetime) -> Iterator[Tuple[datetime, Set, Set]]:
+        """Yields every recorded change of a source after start up to and
+           including end.
+
+        Arguments:
+            source (str): Name of the source.
+            start (datetime): Changes at or before this time are excluded.
+            end (datetime): Changes after this time are excluded.
+
+        Returns:
+            Iterator of (timestamp, added CIDRs, removed CIDRs) tuples.
+        """
+        index = self._load_index(source)
+        first = bisect.bisect_right(index.timestamps, _normalise(start))
+        last = bisect.bisect_right(index.timestamps, _normalise(end))
+
+        for position, record in self._read_records(source, index, first,
+                                                   last):
+            yield (index.timestamps[position], set(record["added"]),
+                   set(record["removed"]))
+
+    def sources(self) -> List[str]:
+        """Lists the names of the sources with recorded history.
+
+        Returns:
+            A sorted list of source names.
+        """
+        return sorted(self._load_sources())
+
+    def _latest_state(self, source: str, index: _SourceIndex) -> Set[str]:
+        if index.latest is None:
+            index.latest = self._state_at_position(source, index,
+                                                   len(index.timestamps) - 1)
+        return set(index.latest)
+
+    def _state_at_position(self, source: str, index: _SourceIndex,
+                           position: int) -> Set[str]:
+        if position < 0:
+            return set()
+
+        checkpoint = index.checkpoints[
+            bisect.bisect_right(index.checkpoints, position) - 1]
+        state: Set[str] = set()
+
+        for _, record in self._read_records(source, index, checkpoint,
+                                            position + 1):
+            if "state" in record:
+                state = set(record["state"])
+            else:
+                state.difference_update(record["removed"])
+                state.update(record["added"])
+
+        return state
+
+    def _read_records(self, source: str, index: _SourceIndex, first: int,
+                      last: int) -> Iterator[Tuple[int, Dict]]:
+        if first >= last:
+            return
+
+        data_path, _ = self._paths(source)
+        with open(data_path, "rb") as data_file:
+            data_file.seek(index.offsets[first])
+            for position in range(first, last):
+                yield (position, json.loads(data_file.readline()))
+
+    def _load_index(self, source: str) -> _SourceIndex:
+        if source in self._indexes:
+            return self._indexes[source]
+
+        index = _SourceIndex()
+        _, index_path = self._paths(source)
+        if os.path.exists(index_path):
+            with open(index_path) as index_file:
+                for line in index_file:
+                    entry = json.loads(line)
+                    if entry["checkpoint"]:
+                        index.checkpoints.append(len(index.timestamps))
+                    index.timestamps.append(
+                        datetime.fromisoformat(entry["timestamp"]))
+                    index.offsets.append(entry["offset"])
+
+        self._indexes[source] = index
+        return index
+
+    def _load_sources(self) -> Set[str]:
+        if self._sources is None:
+            self._sources = set()
+            manifest_path = os.path.join(self.root, MANIFEST_NAME)
+            if os.path.exists(manifest_path):
+                with open(manifest_path) as manifest_file:
+                    for line in manifest_file:
+                        self._sources.add(json.loads(line)["source"])
+        return self._sources
+
+    def _add_source(self, source: str) -> None:
+        sources = self._load_sources()
+        if source in sources:
+            return
+
+        with open(os.path.join(self.root, MANIFEST_NAME), "a") as manifest_file:
+            manifest_file.write(json.dumps({"source": source}) + "\n")
+        sources.add(source)
+
+    def _paths(self, source: str) -> Tuple[str, str]:
+        name = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        return (os.path.join(self.root, f"{name}.jsonl"),
+                os.path.join(self.root, f"{name}.idx"))
+
+
+def _normalise(timestamp: datetime) -> datetime:
+    """Treats naive timestamps as UTC so they can be compared."""
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
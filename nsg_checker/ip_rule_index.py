@@ -0,0 +1,383 @@
+"""IpRuleIndex
+
+Reverse index from source addresses to the NSG rules that match them across a
+fleet of NSGs, answering "which NSGs and rules admit or drop this sender".
+
+CIDR blocks are either nested or disjoint, so the indexed networks form a
+tree. They are kept sorted by start address with a link to their enclosing
+network, which makes a lookup a bisect followed by a walk up at most one
+network per prefix length.
+
+The index is updated one NSG at a time, keyed by the NSG's ETag, so an NSG
+that has not changed is never re-indexed. A changed NSG only touches its own
+networks: rules are added to or removed from networks already indexed in
+O(log N) each, and only networks that are new or left without rules cost a
+single O(N) merge of the sorted lists. The sorted lists and parent links are
+persisted as they are, so loading the index is one JSON parse with no sorting.
+
+The ``Internet`` service tag is indexed as the whole address space and its
+rules carry the tag as ``service_tag``. Other service tags stand for address
+ranges the index does not know, so their rules are not indexed. They are kept
+per NSG and listed by ``skipped`` instead.
+"""
+
+import bisect
+import heapq
+import ipaddress
+import json
+import logging
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# NSG source prefixes that match every address
+ANY_PREFIXES = {"*": ["0.0.0.0/0", "::/0"], "any": ["0.0.0.0/0", "::/0"]}
+
+# NSG service tags indexed as the address space they stand for
+SERVICE_TAG_PREFIXES = {"internet": ["0.0.0.0/0", "::/0"]}
+
+# Version of the persisted index, files of any other version are rebuilt
+INDEX_VERSION = 3
+
+
+class _NetworkTree:
+    """Networks of one IP version sorted by start address, enclosing networks
+    first, with the position of their enclosing network."""
+    def __init__(self,
+                 starts: List[int] = None,
+                 ends: List[int] = None,
+                 parents: List[int] = None,
+                 entries: List[List[Dict]] = None) -> None:
+        self.starts = starts or []
+        self.ends = ends or []
+        self.parents = parents or []
+        self.entries = entries or []
+
+    def position(self, start: int, end: int) -> int:
+        position = bisect.bisect_left(self.starts, start)
+        while position < len(self.starts) and self.starts[position] == start:
+            if self.ends[position] == end:
+                return position
+            position += 1
+        return -1
+
+    def update(self, nsg_id: str, removed: Iterable[Tuple[int, int]],
+               added: Dict[Tuple[int, int], List[Dict]]) -> None:
+        touched = []
+        for start, end in removed:
+            position = self.position(start, end)
+            if position >= 0:
+                self.entries[position] = [
+                    entry for entry in self.entries[position]
+                    if entry["nsg"] != nsg_id
+                ]
+                touched.append(position)
+
+        new_networks = []
+        for (start, end), entries in added.items():
+            position = self.position(start, end)
+            if position >= 0:
+                self.entries[position].extend(entries)
+            else:
+                new_networks.append((start, end, entries))
+
+        if new_networks or any(not self.entries[position]
+                               for position in touched):
+            self._merge(new_networks)
+
+    def overlapping(self, start: int, end: int) -> List[Dict]:
+        matches = set()
+
+        position = bisect.bisect_right(self.starts, start) - 1
+        while position >= 0 and self.ends[position] < end:
+            position = self.parents[position]
+        while position >= 0:
+            matches.add(position)
+            position = self.parents[position]
+
+        first = bisect.bisect_left(self.starts, start)
+        last = bisect.bisect_right(self.starts, end)
+        matches.update(position for position in range(first, last)
+                       if self.ends[position] <= end)
+
+        return [
+            entry for position in matches for entry in self.entries[position]
+        ]
+
+    def to_dict(self) -> Dict:
+        return {
+            "starts": self.starts,
+            "ends": self.ends,
+            "parents": self.parents,
+            "entries": self.entries
+        }
+
+    def _merge(self, new_networks: List[Tuple[int, int, List[Dict]]]) -> None:
+        """Drops networks left without rules and merges new networks into the
+           sorted lists, then links every network to its enclosing network."""
+        kept = ((start, end, entries) for start, end, entries in zip(
+            self.starts, self.ends, self.entries) if entries)
+        merged = list(
+            heapq.merge(kept,
+                        sorted(new_networks, key=_network_order),
+                        key=_network_order))
+
+        self.starts = [start for start, _, _ in merged]
+        self.ends = [end for _, end, _ in merged]
+        self.entries = [entries for _, _, entries in merged]
+        self.parents = []
+
+        enclosing: List[int] = []
+        for position, start in enumerate(self.starts):
+            while enclosing and self.ends[enclosing[-1]] < start:
+                enclosing.pop()
+            self.parents.append(enclosing[-1] if enclosing else -1)
+            enclosing.append(position)
+
+
+class IpRuleIndex:
+    def __init__(self, path: str = None) -> None:
+        """
+        Reverse index of source address prefixes to NSG rules.
+
+        Attributes:
+            path (str): Optional JSON file the index is loaded from and saved to.
+
+        Args:
+            path (str): Optional JSON file the index is loaded from and saved to.
+        """
+        self.path = path
+        self._nsgs: Dict[str, Dict] = {}
+        self._trees: Dict[int, _NetworkTree] = {}
+
+        if path and os.path.exists(path):
+            self._load()
+
+    def etag(self, nsg_id: str) -> Optional[str]:
+        """Retrieves the ETag an NSG was indexed at.
+
+        Arguments:
+            nsg_id (str): The Azure resource ID of the NSG.
+
+        Returns:
+            The ETag, or None if the NSG is not indexed or had no ETag.
+        """
+        return self._nsgs.get(nsg_id, {}).get("etag")
+
+    def update_nsg(self,
+                   nsg_id: str,
+                   etag: Optional[str],
+                   rules: List[Dict],
+                   default_rules: List[Dict] = None) -> bool:
+        """Replaces the indexed rules of one NSG, unless it is already indexed
+           at the same ETag.
+
+        Arguments:
+            nsg_id (str): The Azure resource ID of the NSG.
+            etag (str): The ETag of the NSG.
+            rules (list(dict)): The NSG's rules as stored in the rule cache.
+            default_rules (list(dict)): The NSG's default security rules.
+
+        Returns:
+            True if the NSG was re-indexed, False if it was unchanged.
+        """
+        if etag and nsg_id in self._nsgs and self.etag(nsg_id) == etag:
+            return False
+
+        added: Dict[int, Dict[Tuple[int, int], List[Dict]]] = {}
+        skipped = []
+        count = 0
+        for rule, default in [(rule, False) for rule in rules] + [
+            (rule, True) for rule in default_rules or []
+        ]:
+            prefixes = list(rule.get("source_address_prefixes") or [])
+            if rule.get("source_address_prefix"):
+                prefixes.append(rule["source_address_prefix"])
+            for prefix in prefixes:
+                networks = _networks(prefix)
+                if not networks:
+                    skipped.append(
+                        _entry(nsg_id, rule, prefix, default, prefix))
+                    continue
+
+                service_tag = (prefix if prefix.lower()
+                               in SERVICE_TAG_PREFIXES else None)
+                for network in networks:
+                    key = (int(network.network_address),
+                           int(network.broadcast_address))
+                    added.setdefault(network.version, {}).setdefault(
+                        key, []).append(
+                            _entry(nsg_id, rule, str(network), default,
+                                   service_tag))
+                    count += 1
+
+        self._update_trees(nsg_id, added)
+        self._nsgs[nsg_id] = {
+            "etag":
+            etag,
+            "networks": [[version, start, end]
+                         for version, networks in added.items()
+                         for start, end in networks],
+            "skipped":
+            skipped
+        }
+        logging.info(f"Indexed {count} source prefixes for {nsg_id}")
+        if skipped:
+            logging.info(
+                f"Skipped {len(skipped)} service tag prefixes for {nsg_id}: "
+                f"{sorted({entry['prefix'] for entry in skipped})}")
+
+        return True
+
+    def remove_nsg(self, nsg_id: str) -> None:
+        """Removes an NSG from the index.
+
+        Arguments:
+            nsg_id (str): The Azure resource ID of the NSG.
+        """
+        if nsg_id in self._nsgs:
+            self._update_trees(nsg_id, {})
+            del self._nsgs[nsg_id]
+
+    def lookup(self, address: str, direction: str = "Inbound") -> List[Dict]:
+        """Finds the NSG rules whose source prefixes overlap an IP or CIDR.
+
+        Arguments:
+            address (str): A single IP address or a CIDR.
+            direction (str): Only match rules of this direction, None for all.
+
+        Raises:
+            ValueError if the address is not an IP address or CIDR.
+
+        Returns:
+            The matching rules with their nsg, rule, priority, access, direction,
+            ports, prefix, service tag and whether they are default rules,
+            ordered by NSG and priority. Rules of service tags that are not
+            indexed are never returned, see skipped.
+        """
+        network = ipaddress.ip_network(address, strict=False)
+        tree = self._trees.get(network.version)
+        if tree is None:
+            return []
+
+        return _ordered(
+            tree.overlapping(int(network.network_address),
+                             int(network.broadcast_address)), direction)
+
+    def skipped(self, direction: str = "Inbound") -> List[Dict]:
+        """Lists the rules whose source prefix is a service tag the index
+           does not know the addresses of, so lookups cannot match them.
+
+        Arguments:
+            direction (str): Only list rules of this direction, None for all.
+
+        Returns:
+            The rules in the same form as lookup, with the service tag as
+            their prefix, ordered by NSG and priority.
+        """
+        return _ordered((entry for nsg in self._nsgs.values()
+                         for entry in nsg.get("skipped", [])), direction)
+
+    def save(self) -> None:
+        """Writes the index to its JSON file, if it has one."""
+        if not self.path:
+            return
+
+        data = {
+            "version": INDEX_VERSION,
+            "nsgs": self._nsgs,
+            "trees": {
+                str(version): tree.to_dict()
+                for version, tree in self._trees.items()
+            }
+        }
+
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w") as index_file:
+            json.dump(data, index_file)
+        os.replace(temporary_path, self.path)
+
+        logging.info(f"Saved {len(self._nsgs)} NSGs to rule index {self.path}")
+
+    def _update_trees(self, nsg_id: str,
+                      added: Dict[int, Dict[Tuple[int, int],
+                                            List[Dict]]]) -> None:
+        removed: Dict[int, List[Tuple[int, int]]] = {}
+        for version, start, end in self._nsgs.get(nsg_id,
+                                                  {}).get("networks", []):
+            removed.setdefault(version, []).append((start, end))
+
+        for version in set(removed) | set(added):
+            tree = self._trees.setdefault(version, _NetworkTree())
+            tree.update(nsg_id, removed.get(version, []),
+                        added.get(version, {}))
+
+    def _load(self) -> None:
+        with open(self.path) as index_file:
+            data = json.load(index_file)
+
+        if not isinstance(data, dict) or data.get("version") != INDEX_VERSION:
+            logging.warning(
+                f"Discarding rule index {self.path} written by another version."
+            )
+            return
+
+        self._nsgs = data["nsgs"]
+        self._trees = {
+            int(version): _NetworkTree(**tree)
+            for version, tree in data["trees"].items()
+        }
+        logging.info(f"Loaded {len(self._nsgs)} NSGs from rule index {self.path}")
+
+
+def _network_order(network: Tuple[int, int, List[Dict]]) -> Tuple[int, int]:
+    """Sorts networks by start address with enclosing networks first."""
+    return (network[0], -network[1])
+
+
+def _ordered(entries: Iterable[Dict], direction: Optional[str]) -> List[Dict]:
+    """Filters entries by direction and orders them by NSG and priority."""
+    entries = [
+        entry for entry in entries if direction is None or
+        (entry["direction"] or "").lower() == direction.lower()
+    ]
+
+    return sorted(entries,
+                  key=lambda entry:
+                  (entry["nsg"], entry["priority"] is None, entry["priority"]
+                   or 0, entry["rule"]))
+
+
+def _entry(nsg_id: str, rule: Dict, prefix: str, default: bool,
+           service_tag: Optional[str]) -> Dict:
+    return {
+        "nsg": nsg_id,
+        "prefix": prefix,
+        "service_tag": service_tag,
+        "rule": rule["name"],
+        "priority": rule.get("priority"),
+        "access": rule.get("access"),
+        "direction": rule.get("direction"),
+        "ports": _ports(rule),
+        "default": default
+    }
+
+
+def _networks(prefix: str) -> List:
+    """Normalises an NSG source prefix into networks, returning none for
+       service tags that are not indexed."""
+    prefixes = ANY_PREFIXES.get(prefix.lower()) or SERVICE_TAG_PREFIXES.get(
+        prefix.lower(), [prefix])
+
+    try:
+        return [
+            ipaddress.ip_network(prefix, strict=False) for prefix in prefixes
+        ]
+    except ValueError:
+        return []
+
+
+def _ports(rule: Dict) -> List[str]:
+    ports = list(rule.get("destination_port_ranges") or [])
+    if rule.get("destination_port_range"):
+        ports.append(rule["destination_port_range"])
+    return ports
@@ -6,44 +6,114 @@ Author:
 """
 
 import logging
-from typing import Set
+from typing import List, Optional, Set
 
 from slack import WebClient
 
 
+class ProviderResult:
+    def __init__(self, name: str, label: str, description: str,
+                 expected: Optional[Set], actual: Set) -> None:
+        """
+        Difference between a provider's current CIDRs and those on an Azure NSG.
+
+        Attributes:
+            name (str): Unique name of the provider, e.g. "o365".
+            label (str): Short name of the provider, e.g. "O365".
+            description (str): Long name of the provider, e.g. "O365 Exchange".
+            fetch_failed (bool): Whether the provider's CIDRs could not be retrieved.
+            missing (set): CIDRs of the provider missing from the NSG.
+            extra (set): CIDRs on the NSG the provider no longer uses.
+
+        Args:
+            name (str): Unique name of the provider.
+            label (str): Short name of the provider.
+            description (str): Long name of the provider.
+            expected (set): The provider's current CIDRs, None if the fetch failed.
+            actual (set): The provider's CIDRs found on the NSG.
+        """
+        self.name = name
+        self.label = label
+        self.description = description
+        self.fetch_failed = expected is None
+        self.missing = set() if self.fetch_failed else expected - actual
+        self.extra = set() if self.fetch_failed else actual - expected
+
+
 class MessageDispatcher:
-    def __init__(self, o365_rules: Set, gsuite_rules: Set,
-                 o365_azure_rules: Set, gsuite_azure_rules: Set,
+    def __init__(self, provider_results: List[ProviderResult],
                  slack_oauth: str, slack_channel: str) -> None:
         """
-        MessageDispatcher for the Azure NSG Checker. It takes the IP sets, calculates
-        the differences between them and then dispatches the message.
+        MessageDispatcher for the Azure NSG Checker. It takes the differences
+        between each provider's CIDRs and the NSG and dispatches the message.
 
         Attributes:
-            missing_o365 (set): A set of missing O365 NSG rules.
-            extra_o365 (set): A set of extra O365 NSG rules.
-            missing_gsuite (set): A set of missing GSUITE NSG rules.
-            extra_gsuite (set): A set of extra GSUITE NSG rules.
+            provider_results (list(ProviderResult)): The results in message order.
             slack_client (WebClient): Slack Client to dispatch messages.
             slack_channel (str): The slack channel ID to send notifications to.
-        
+
         Args:
-            o365_rules (set): The set of current O365 SMTP IPv4 addresses.
-            o365_azure_rules (set): The set of current O365 IPv4 addresses.
-            gsuite_azure_rules (set): The set of current GSUITE SMTP IPv4 addresses on an Azure NSG.
-            o365_rules (set): The set of current O365 IPv4 addresses address on an Azure NSG.
+            provider_results (list(ProviderResult)): The results in message order.
             slack_oauth (str): The slack Oauth token.
             slack_channel (str): The slack channel ID to send notifications to.
-        
         """
 
-        self.missing_o365 = o365_rules.difference(o365_azure_rules)
-        self.extra_o365 = o365_azure_rules - o365_rules
-        self.missing_gsuite = gsuite_rules.difference(gsuite_azure_rules)
-        self.extra_gsuite = gsuite_azure_rules - gsuite_rules
+        self.provider_results = provider_results
         self.slack_client = WebClient(token=slack_oauth)
         self.slack_channel = slack_channel
 
+    @classmethod
+    def from_rule_sets(cls, o365_rules: Set, gsuite_rules: Set,
+                       o365_azure_rules: Set, gsuite_azure_rules: Set,
+                       slack_oauth: str,
+                       slack_channel: str) -> "MessageDispatcher":
+        """
+        Creates a MessageDispatcher for O365 and GSUITE from their IP sets.
+
+        Args:
+            o365_rules (set): The set of current O365 SMTP IPv4 addresses.
+            gsuite_rules (set): The set of current GSUITE SMTP IPv4 addresses.
+            o365_azure_rules (set): The set of O365 IPv4 addresses on an Azure NSG.
+            gsuite_azure_rules (set): The set of GSUITE IPv4 addresses on an Azure NSG.
+            slack_oauth (str): The slack Oauth token.
+            slack_channel (str): The slack channel ID to send notifications to.
+
+        Returns:
+            The MessageDispatcher.
+        """
+        return cls([
+            ProviderResult("o365", "O365", "O365 Exchange", o365_rules,
+                           o365_azure_rules),
+            ProviderResult("gsuite", "GSUITE", "GSUITE Gmail", gsuite_rules,
+                           gsuite_azure_rules)
+        ], slack_oauth, slack_channel)
+
+    @property
+    def missing_o365(self) -> Set:
+        """A set of missing O365 NSG rules."""
+        return self._provider_result("o365", "missing")
+
+    @property
+    def extra_o365(self) -> Set:
+        """A set of extra O365 NSG rules."""
+        return self._provider_result("o365", "extra")
+
+    @property
+    def missing_gsuite(self) -> Set:
+        """A set of missing GSUITE NSG rules."""
+        return self._provider_result("gsuite", "missing")
+
+    @property
+    def extra_gsuite(self) -> Set:
+        """A set of extra GSUITE NSG rules."""
+        return self._provider_result("gsuite", "extra")
+
+    def _provider_result(self, name: str, field: str) -> Set:
+        for provider_result in self.provider_results:
+            if provider_result.name == name:
+                return getattr(provider_result, field)
+        return set()
+
     def dispatch_slack_message(self):
         """
         Dispatches the message to stdout. PLACEHOLDER for SNS work
@@ -68,29 +138,28 @@ class MessageDispatcher:
             The slack message in a format that can be read my users.
         """
         intro_message = "Here is your update from the Azure NSG Watcher:\n"
-        extra_o365_message, extra_gsuite_message = "", ""
-
-        if self.missing_o365:
-            missing_o365_message = f"These port 25 SMTP Ingress NSG rules are missing for O365 Exchange:\n\n{self.pretty_nsg_sets(self.missing_o365)}"
-        else:
-            missing_o365_message = "No O365 NSG rules are missing"
-
-        if self.missing_gsuite:
-            missing_gsuite_message = f"These port 25 SMTP Ingress NSG rules are missing for GSUITE Gmail:\n\n{self.pretty_nsg_sets(self.missing_gsuite)}"
-        else:
-            missing_gsuite_message = "No GSUITE NSG rules are missing"
-
-        if self.extra_o365:
-            extra_o365_message = f"These port 25 SMTP NSG rules for O365 Exchange are no longer needed:\n\n{self.pretty_nsg_sets(self.extra_o365)}"
-
-        if self.extra_gsuite:
-            extra_gsuite_message = f"These port 25 SMTP NSG rules for GSUITE Gmail are no longer needed:\n\n{self.pretty_nsg_sets(self.extra_gsuite)}"
-
-        result = '\n'.join(
-            filter(None, [
-                intro_message, missing_o365_message, missing_gsuite_message,
-                extra_o365_message, extra_gsuite_message
-            ]))
+        missing_messages, extra_messages = [], []
+
+        for provider_result in self.provider_results:
+            if provider_result.fetch_failed:
+                missing_messages.append(
+                    f"Unable to retrieve the current {provider_result.description} CIDRs, its NSG rules were not checked"
+                )
+            elif provider_result.missing:
+                missing_messages.append(
+                    f"These port 25 SMTP Ingress NSG rules are missing for {provider_result.description}:\n\n{self.pretty_nsg_sets(provider_result.missing)}"
+                )
+            else:
+                missing_messages.append(
+                    f"No {provider_result.label} NSG rules are missing")
+
+            if provider_result.extra:
+                extra_messages.append(
+                    f"These port 25 SMTP NSG rules for {provider_result.description} are no longer needed:\n\n{self.pretty_nsg_sets(provider_result.extra)}"
+                )
+
+        result = '\n'.join([intro_message] + missing_messages +
+                            extra_messages)
 
         return result
 
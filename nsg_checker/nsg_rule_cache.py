@@ -0,0 +1,145 @@
+"""NsgRuleCache
+
+Keeps the ETag and parsed rules of every NSG fetched, so an NSG that has not
+changed since the last run is not parsed again. Derived data
+such as indexes and diffs is held on the cache entry and is dropped only when
+the NSG's ETag changes.
+"""
+
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+# Version of the persisted cache, files of any other version are discarded
+CACHE_VERSION = 3
+
+
+class NsgRuleCacheEntry:
+    def __init__(self,
+                 etag: Optional[str],
+                 rules: List[Dict],
+                 default_rules: List[Dict] = None) -> None:
+        """
+        Parsed state of one NSG at a given ETag.
+
+        Attributes:
+            etag (str): The ETag of the NSG when it was parsed.
+            rules (list(dict)): The NSG's security rules as plain dictionaries.
+            default_rules (list(dict)): The NSG's default security rules.
+            derived (dict): Data derived from the rules, keyed by name.
+
+        Args:
+            etag (str): The ETag of the NSG when it was parsed.
+            rules (list(dict)): The NSG's security rules as plain dictionaries.
+            default_rules (list(dict)): The NSG's default security rules.
+        """
+        self.etag = etag
+        self.rules = rules
+        self.default_rules = default_rules or []
+        self.derived: Dict[str, Any] = {}
+
+    def derived_value(self, name: str, factory: Callable[[], Any]) -> Any:
+        """Retrieves data derived from this entry, computing it on first use.
+
+        Arguments:
+            name (str): Name of the derived data.
+            factory (Callable): Computes the data when it is not cached yet.
+
+        Returns:
+            The cached or newly computed data.
+        """
+        if name not in self.derived:
+            self.derived[name] = factory()
+        return self.derived[name]
+
+
+class NsgRuleCache:
+    def __init__(self, path: str = None) -> None:
+        """
+        Cache of parsed NSG rules keyed by the NSG's Azure resource ID.
+
+        Attributes:
+            path (str): Optional JSON file the cache is loaded from and saved to.
+
+        Args:
+            path (str): Optional JSON file the cache is loaded from and saved to.
+        """
+        self.path = path
+        self._entries: Dict[str, NsgRuleCacheEntry] = {}
+
+        if path and os.path.exists(path):
+            self._load()
+
+    def get(self, nsg_id: str) -> Optional[NsgRuleCacheEntry]:
+        """Retrieves the cached entry of an NSG.
+
+        Arguments:
+            nsg_id (str): The Azure resource ID of the NSG.
+
+        Returns:
+            The cache entry, or None if the NSG has not been cached.
+        """
+        return self._entries.get(nsg_id)
+
+    def put(self,
+            nsg_id: str,
+            etag: Optional[str],
+            rules: List[Dict],
+            default_rules: List[Dict] = None) -> NsgRuleCacheEntry:
+        """Stores the parsed state of an NSG, discarding any data derived
+           from its previous state.
+
+        Arguments:
+            nsg_id (str): The Azure resource ID of the NSG.
+            etag (str): The ETag of the NSG.
+            rules (list(dict)): The NSG's security rules as plain dictionaries.
+            default_rules (list(dict)): The NSG's default security rules.
+
+        Returns:
+            The new cache entry.
+        """
+        entry = NsgRuleCacheEntry(etag, rules, default_rules)
+        self._entries[nsg_id] = entry
+        return entry
+
+    def save(self) -> None:
+        """Writes the cache to its JSON file, if it has one."""
+        if not self.path:
+            return
+
+        data = {
+            "version":
+            CACHE_VERSION,
+            "entries": [{
+                "nsg_id": nsg_id,
+                "etag": entry.etag,
+                "rules": entry.rules,
+                "default_rules": entry.default_rules
+            } for nsg_id, entry in self._entries.items()]
+        }
+
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w") as cache_file:
+            json.dump(data, cache_file)
+        os.replace(temporary_path, self.path)
+
+        logging.info(
+            f"Saved {len(self._entries)} NSGs to rule cache {self.path}")
+
+    def _load(self) -> None:
+        with open(self.path) as cache_file:
+            data = json.load(cache_file)
+
+        if not isinstance(data, dict) or data.get("version") != CACHE_VERSION:
+            logging.warning(
+                f"Discarding rule cache {self.path} written by another version."
+            )
+            return
+
+        for item in data["entries"]:
+            self.put(item["nsg_id"], item["etag"], item["rules"],
+                     item["default_rules"])
+
+        logging.info(
+            f"Loaded {len(self._entries)} NSGs from rule cache {self.path}")
@@ -0,0 +1,419 @@
+"""Providers
+
+Sources of the CIDRs a sender uses, and the registry that matches NSG rules to
+them. Rules are matched to a provider by tag: an ``nsg-checker:<tag>`` marker in
+the rule's description, or else the first token of the rule's name, e.g.
+``o365`` for ``o365-smtp-40.92.0.0-15``.
+
+``fetch_all`` fetches the providers concurrently on a thread pool. Every
+provider caches its CIDRs for ``ttl`` seconds. The cache lives on the provider,
+so it only helps callers that keep the registry, such as a check of several
+NSGs in one process.
+"""
+
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+import requests
+
+AWS_IP_RANGES_URL = "https://ip-ranges.amazonaws.com/ip-ranges.json"
+NOT_MODIFIED_STATUS_CODE = 304
+
+# Seconds to wait for a provider's source to connect or send data
+REQUEST_TIMEOUT = 30
+
+DESCRIPTION_TAG_PATTERN = re.compile(r"nsg-checker:([\w.-]+)", re.IGNORECASE)
+NAME_TAG_PATTERN = re.compile(r"[-_. ]")
+
+
+class ProviderFetchError(Exception):
+    """Raised when a provider's CIDRs could not be retrieved in full."""
+
+
+class Provider:
+    def __init__(self,
+                 name: str,
+                 label: str,
+                 description: str,
+                 tag: str = None,
+                 ports: Iterable[str] = ("25", ),
+                 ttl: float = 3600,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        """
+        Base class of a sender whose CIDRs are checked against NSG rules.
+        Subclasses implement fetch.
+
+        Attributes:
+            name (str): Unique name of the provider, e.g. "o365".
+            label (str): Short name used in messages, e.g. "O365".
+            description (str): Long name used in messages, e.g. "O365 Exchange".
+            tag (str): Tag that marks an NSG rule as belonging to the provider.
+            ports (set(str)): Destination ports a rule must open to be matched.
+            ttl (float): Seconds the fetched CIDRs are cached for.
+
+        Args:
+            name (str): Unique name of the provider.
+            label (str): Short name used in messages.
+            description (str): Long name used in messages.
+            tag (str): Tag of the provider's NSG rules, defaults to the name.
+            ports (Iterable[str]): Destination ports a rule must open to be matched.
+            ttl (float): Seconds the fetched CIDRs are cached for.
+            clock (Callable): Monotonic clock returning seconds.
+        """
+        self.name = name
+        self.label = label
+        self.description = description
+        self.tag = (tag or name).lower()
+        self.ports = set(ports)
+        self.ttl = ttl
+        self._clock = clock
+        self._cidrs: Optional[Set[str]] = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+
+    def fetch(self) -> Set[str]:
+        """Retrieves the provider's current CIDRs from its source.
+
+        Raises:
+            ProviderFetchError if the CIDRs could not be retrieved in full.
+
+        Returns:
+            Set of CIDRs.
+        """
+        raise NotImplementedError
+
+    def cidrs(self) -> Set[str]:
+        """Retrieves the provider's CIDRs, fetching them only when the cached
+           copy is older than the ttl.
+
+        Returns:
+            Set of CIDRs.
+        """
+        with self._lock:
+            if (self._cidrs is None
+                    or self._clock() - self._fetched_at >= self.ttl):
+                self._cidrs = set(self.fetch())
+                self._fetched_at = self._clock()
+            return set(self._cidrs)
+
+    def matches_rule(self, rule: Dict) -> bool:
+        """Checks whether a cached NSG rule opens one of the provider's ports."""
+        ports = set(rule.get("destination_port_ranges") or [])
+        if rule.get("destination_port_range"):
+            ports.add(rule["destination_port_range"])
+
+        return bool(ports & self.ports)
+
+
+class FunctionProvider(Provider):
+    def __init__(self, name: str, label: str, description: str,
+                 fetch: Callable[[], Set[str]], **kwargs) -> None:
+        """
+        Provider whose CIDRs are retrieved by a function, e.g.
+        AzureNSGChecker.get_o365_smtp_ipv4_cidrs.
+
+        Args:
+            name (str): Unique name of the provider.
+            label (str): Short name used in messages.
+            description (str): Long name used in messages.
+            fetch (Callable): Function returning the provider's CIDRs.
+            kwargs: Remaining Provider arguments.
+        """
+        super().__init__(name, label, description, **kwargs)
+        self._fetch = fetch
+
+    def fetch(self) -> Set[str]:
+        try:
+            return self._fetch()
+        except (requests.RequestException, ValueError) as error:
+            raise ProviderFetchError(
+                f"Unable to retrieve {self.name} CIDRs: {error}") from error
+
+
+class AwsIpRangesIndex:
+    def __init__(self, ip_ranges: Dict) -> None:
+        """
+        Index of AWS's ip-ranges.json by region and service, so filtered
+        queries only touch the matching groups of prefixes.
+
+        Attributes:
+            sync_token (str): The syncToken of the parsed document.
+            regions (set(str)): Every region in the document.
+            services (set(str)): Every service in the document.
+
+        Args:
+            ip_ranges (Dict): The parsed ip-ranges.json document.
+        """
+        self.sync_token = ip_ranges.get("syncToken")
+        self._prefixes: Dict[tuple, Set[str]] = {}
+
+        for prefix in ip_ranges.get("prefixes", []):
+            self._add(4, prefix["region"], prefix["service"],
+                      prefix["ip_prefix"])
+        for prefix in ip_ranges.get("ipv6_prefixes", []):
+            self._add(6, prefix["region"], prefix["service"],
+                      prefix["ipv6_prefix"])
+
+        self.regions = {region for _, region, _ in self._prefixes}
+        self.services = {service for _, _, service in self._prefixes}
+
+    def query(self,
+              regions: Iterable[str] = None,
+              services: Iterable[str] = None,
+              version: int = 4) -> Set[str]:
+        """Retrieves the prefixes of the given regions and services.
+
+        Arguments:
+            regions (Iterable[str]): Regions to include, all when None.
+            services (Iterable[str]): Services to include, all when None.
+            version (int): IP version of the prefixes.
+
+        Returns:
+            Set of CIDRs.
+        """
+        regions = self.regions if regions is None else set(regions)
+        services = self.services if services is None else set(services)
+        result = set()
+
+        for region in regions:
+            for service in services:
+                result.update(
+                    self._prefixes.get((version, region, service), ()))
+
+        return result
+
+    def _add(self, version: int, region: str, service: str,
+             prefix: str) -> None:
+        self._prefixes.setdefault((version, region, service), set()).add(prefix)
+
+
+class AwsIpRangesProvider(Provider):
+    def __init__(self,
+                 regions: Iterable[str] = None,
+                 services: Iterable[str] = None,
+                 url: str = AWS_IP_RANGES_URL,
+                 name: str = "aws",
+                 label: str = "AWS",
+                 description: str = "AWS",
+                 timeout: float = REQUEST_TIMEOUT,
+                 **kwargs) -> None:
+        """
+        Provider of AWS CIDRs from ip-ranges.json, filtered by region and
+        service.
+
+        Attributes:
+            regions (set(str)): Regions to include, all when None.
+            services (set(str)): Services to include, all when None.
+            url (str): URL of ip-ranges.json.
+            index (AwsIpRangesIndex): Index of the last document retrieved.
+            etag (str): ETag of the last document retrieved.
+            last_modified (str): Last-Modified date of the last document retrieved.
+            timeout (float): Seconds to wait for AWS to connect or send data.
+
+        Args:
+            regions (Iterable[str]): Regions to include, all when None.
+            services (Iterable[str]): Services to include, all when None.
+            url (str): URL of ip-ranges.json.
+            name (str): Unique name of the provider.
+            label (str): Short name used in messages.
+            description (str): Long name used in messages.
+            timeout (float): Seconds to wait for AWS to connect or send data.
+            kwargs: Remaining Provider arguments.
+        """
+        super().__init__(name, label, description, **kwargs)
+        self.timeout = timeout
+        self.regions = set(regions) if regions is not None else None
+        self.services = set(services) if services is not None else None
+        self.url = url
+        self.index: Optional[AwsIpRangesIndex] = None
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+
+    def fetch(self) -> Set[str]:
+        """Retrieves ip-ranges.json with a conditional request, only parsing
+           it when it has changed since the index was built."""
+        logging.info(f"Retrieving AWS IP ranges from {self.url}")
+        headers = {}
+        if self.index is not None and self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.index is not None and self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+
+        try:
+            response = requests.get(self.url,
+                                    headers=headers,
+                                    timeout=self.timeout)
+        except requests.RequestException as error:
+            raise ProviderFetchError(
+                f"Unable to reach AWS: {error}") from error
+
+        if response.status_code == NOT_MODIFIED_STATUS_CODE and self.index:
+            logging.info("AWS IP ranges not modified, using the cached index.")
+            return self.index.query(self.regions, self.services)
+
+        if response.status_code != 200:
+            raise ProviderFetchError(
+                f"{response.status_code} returned by AWS. No AWS rules retrieved."
+            )
+
+        etag = response.headers.get("ETag")
+        if self.index is None or not etag or etag != self.etag:
+            try:
+                ip_ranges = json.loads(response.text)
+                if self.index is None or self.index.sync_token != ip_ranges.get(
+                        "syncToken"):
+                    self.index = AwsIpRangesIndex(ip_ranges)
+            except (AttributeError, KeyError, ValueError) as error:
+                raise ProviderFetchError(
+                    f"Invalid IP ranges returned by AWS: {error}") from error
+        self.etag = etag
+        self.last_modified = response.headers.get("Last-Modified")
+        logging.info(
+            f"Successfully retrieved AWS IP ranges {self.index.sync_token}.")
+
+        return self.index.query(self.regions, self.services)
+
+
+class ProviderRegistry:
+    def __init__(self, max_workers: int = 4) -> None:
+        """
+        Registry of the providers checked, matching NSG rules to them by tag.
+
+        Args:
+            max_workers (int): Number of providers fetch_all fetches concurrently.
+        """
+        self._providers: Dict[str, Provider] = {}
+        self._max_workers = max_workers
+
+    def __iter__(self) -> Iterator[Provider]:
+        return iter(self._providers.values())
+
+    def register(self, provider: Provider) -> Provider:
+        """Adds a provider to the registry.
+
+        Arguments:
+            provider (Provider): The provider to add.
+
+        Raises:
+            ValueError if a provider with the same name or tag is registered.
+
+        Returns:
+            The provider added.
+        """
+        for registered in self:
+            if provider.name == registered.name or provider.tag == registered.tag:
+                raise ValueError(
+                    f"Provider {provider.name} clashes with {registered.name}")
+
+        self._providers[provider.name] = provider
+        return provider
+
+    def get(self, name: str) -> Provider:
+        """Retrieves a registered provider by name."""
+        return self._providers[name]
+
+    def signature(self) -> str:
+        """Describes the registered providers and their tags, used to key data
+           derived from the registry."""
+        return ",".join(f"{provider.name}={provider.tag}:"
+                        f"{'|'.join(sorted(provider.ports))}"
+                        for provider in self)
+
+    def match_rule(self, rule: Dict) -> Optional[Provider]:
+        """Finds the provider an NSG rule belongs to.
+
+        Arguments:
+            rule (dict): The rule as stored in the rule cache.
+
+        Returns:
+            The provider whose tag the rule carries and whose ports it opens,
+            or None.
+        """
+        tag = rule_tag(rule)
+        for provider in self:
+            if provider.tag == tag and provider.matches_rule(rule):
+                return provider
+        return None
+
+    def classify(self, rules: List[Dict]) -> Dict[str, List[Dict]]:
+        """Groups NSG rules by the provider they belong to. Inbound Allow rules
+           that open a provider's port but carry no registered tag are logged,
+           as they are not checked.
+
+        Arguments:
+            rules (list(dict)): Rules as stored in the rule cache.
+
+        Returns:
+            The rules of every registered provider keyed by provider name.
+        """
+        result = {provider.name: [] for provider in self}
+        for rule in rules:
+            provider = self.match_rule(rule)
+            if provider is not None:
+                result[provider.name].append(rule)
+            elif _is_inbound_allow(rule) and any(
+                    provider.matches_rule(rule) for provider in self):
+                logging.warning(
+                    f"NSG rule {rule['name']} tagged {rule_tag(rule)} matches "
+                    f"no provider and is not checked.")
+        return result
+
+    def fetch_all(self) -> Dict[str, Optional[Set[str]]]:
+        """Retrieves the CIDRs of every registered provider concurrently.
+
+        Returns:
+            The CIDRs of every provider keyed by provider name, None for the
+            providers whose fetch failed.
+        """
+        providers = list(self)
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            results = executor.map(_fetch_or_none, providers)
+            return {
+                provider.name: cidrs
+                for provider, cidrs in zip(providers, results)
+            }
+
+
+def _fetch_or_none(provider: Provider) -> Optional[Set[str]]:
+    try:
+        return provider.cidrs()
+    except ProviderFetchError as error:
+        logging.error(f"Unable to retrieve {provider.name} CIDRs: {error}")
+        return None
+
+
+def _is_inbound_allow(rule: Dict) -> bool:
+    return ((rule.get("direction") or "").lower() == "inbound"
+            and (rule.get("access") or "").lower() == "allow")
+
+
+def rule_tag(rule: Dict) -> str:
+    """Retrieves the provider tag of a cached NSG rule.
+
+    Arguments:
+        rule (dict): The rule as stored in the rule cache.
+
+    Returns:
+        The tag from an "nsg-checker:<tag>" marker in the rule description,
+        otherwise the first token of the rule name, lower cased.
+    """
+    match = DESCRIPTION_TAG_PATTERN.search(rule.get("description") or "")
+    if match:
+        return match.group(1).lower()
+
+    return NAME_TAG_PATTERN.split(rule["name"], 1)[0].lower()
+
+
+def rule_prefixes(rules: List[Dict]) -> Set[str]:
+    """Collects the source address prefixes of NSG rules."""
+    prefixes = set()
+    for rule in rules:
+        prefixes.update(rule.get("source_address_prefixes") or [])
+        if rule.get("source_address_prefix"):
+            prefixes.add(rule["source_address_prefix"])
+    return prefixes
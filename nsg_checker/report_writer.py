@@ -0,0 +1,258 @@
+"""JsonLinesReportWriter
+
+Streams machine readable check results as JSON Lines, one record per NSG per
+provider. Each record is flushed as soon as it is written, so memory stays
+flat across a fleet and downstream tooling can consume results while the run
+is still going.
+
+``missing`` and ``extra`` compare the provider's CIDRs verbatim with the
+prefixes of the rules tagged for the provider, as the Slack message does.
+``covered_by``, ``denied_by`` and ``uncovered`` answer whether port 25 traffic
+from each CIDR is admitted, whichever provider the rules are tagged for. The
+inbound rules of the NSG that apply to port 25 are evaluated in priority
+order and the first rule whose source matches an address decides, so a Deny
+rule blocks the addresses it matches from every rule after it. The
+``Internet`` service tag is taken as the whole address space, as provider
+CIDRs are public. Other service tags cannot be evaluated, and the rules
+using them that were reached are listed in ``unevaluated_rules``.
+"""
+
+import gzip
+import ipaddress
+import json
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+from nsg_checker.ip_rule_index import ANY_PREFIXES, SERVICE_TAG_PREFIXES
+
+SMTP_PORT = 25
+
+
+class JsonLinesReportWriter:
+    def __init__(self, path: str, compress: bool = None) -> None:
+        """
+        Writer of JSON Lines check reports.
+
+        Attributes:
+            path (str): The file the report is written to.
+            compress (bool): Whether the report is gzip compressed.
+            records_written (int): Number of records written so far.
+
+        Args:
+            path (str): The file the report is written to.
+            compress (bool): Gzip the report, defaults to True when path ends in .gz.
+        """
+        self.path = path
+        self.compress = path.endswith(".gz") if compress is None else compress
+        self.records_written = 0
+
+        if self.compress:
+            self._file = gzip.open(path, "wt", encoding="utf-8")
+        else:
+            self._file = open(path, "w", encoding="utf-8")
+
+        logging.info(f"Writing JSON Lines report to {path}")
+
+    def __enter__(self) -> "JsonLinesReportWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def write_result(self,
+                     nsg_id: str,
+                     provider: str,
+                     expected: Optional[Set[str]],
+                     actual: Set[str],
+                     rules: List[Dict],
+                     nsg_rules: List[Dict] = None) -> Dict:
+        """Writes the result of checking one provider against one NSG.
+
+        Arguments:
+            nsg_id (str): The Azure resource ID of the NSG.
+            provider (str): Name of the provider checked.
+            expected (set(str)): The provider's current CIDRs, None if the fetch failed.
+            actual (set(str)): The provider's CIDRs found on the NSG.
+            rules (list(dict)): The NSG rules tagged for the provider.
+            nsg_rules (list(dict)): Every rule of the NSG, defaults to rules.
+
+        Returns:
+            The record that was written.
+        """
+        fetch_failed = expected is None
+        expected = set() if fetch_failed else expected
+        access = evaluate_access(expected,
+                                 rules if nsg_rules is None else nsg_rules)
+        record = {
+            "nsg": nsg_id,
+            "provider": provider,
+            "fetch_failed": fetch_failed,
+            "missing": [] if fetch_failed else sorted(expected - actual),
+            "extra": [] if fetch_failed else sorted(actual - expected),
+            "covered_by": access["covered_by"],
+            "denied_by": access["denied_by"],
+            "uncovered": access["uncovered"],
+            "unevaluated_rules": access["unevaluated_rules"],
+            "rule_ids": [rule_id(rule) for rule in rules]
+        }
+
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        self.records_written += 1
+
+        return record
+
+    def close(self) -> None:
+        """Closes the report file."""
+        if not self._file.closed:
+            self._file.close()
+            logging.info(
+                f"Wrote {self.records_written} records to {self.path}")
+
+
+def evaluate_access(cidrs: Set[str], rules: List[Dict]) -> Dict:
+    """Evaluates which CIDRs an NSG admits on port 25.
+
+    The inbound rules that apply to port 25 are walked in priority order, as
+    Azure does, and each rule decides for the addresses of a CIDR that no
+    earlier rule matched.
+
+    Arguments:
+        cidrs (set(str)): The CIDRs to evaluate.
+        rules (list(dict)): NSG rules as stored in the rule cache.
+
+    Returns:
+        A dict with covered_by, the IDs of the Allow rules admitting each CIDR
+        that is admitted in full, denied_by, the IDs of the Deny rules
+        blocking part of each CIDR, uncovered, the CIDRs not admitted in
+        full, and unevaluated_rules, the IDs of the rules reached whose
+        service tag sources could not be evaluated.
+    """
+    ordered_rules = []
+    for rule in sorted(smtp_rules(rules),
+                       key=lambda rule: (rule.get("priority") is None,
+                                         rule.get("priority") or 0)):
+        networks, unevaluated = _source_networks(rule)
+        ordered_rules.append((rule, networks, unevaluated))
+
+    result = {
+        "covered_by": {},
+        "denied_by": {},
+        "uncovered": [],
+        "unevaluated_rules": set()
+    }
+    for cidr in sorted(cidrs):
+        network = _network(cidr)
+        remaining = [] if network is None else [network]
+        allowed_by, denied_by = set(), set()
+
+        for rule, networks, unevaluated in ordered_rules:
+            if not remaining:
+                break
+            if unevaluated:
+                result["unevaluated_rules"].add(rule_id(rule))
+
+            matched, remaining = _match(remaining, networks)
+            if matched and (rule.get("access") or "").lower() == "allow":
+                allowed_by.add(rule_id(rule))
+            elif matched:
+                denied_by.add(rule_id(rule))
+
+        if denied_by:
+            result["denied_by"][cidr] = sorted(denied_by)
+        if network is None or remaining or denied_by:
+            result["uncovered"].append(cidr)
+        else:
+            result["covered_by"][cidr] = sorted(allowed_by)
+
+    result["unevaluated_rules"] = sorted(result["unevaluated_rules"])
+    return result
+
+
+def smtp_rules(rules: List[Dict]) -> List[Dict]:
+    """Filters NSG rules down to the inbound rules that apply to port 25.
+
+    Arguments:
+        rules (list(dict)): NSG rules as stored in the rule cache.
+
+    Returns:
+        The Allow and Deny rules that decide on SMTP traffic.
+    """
+    return [
+        rule for rule in rules
+        if (rule.get("direction") or "").lower() == "inbound" and any(
+            _port_range_contains(port_range, SMTP_PORT)
+            for port_range in _port_ranges(rule))
+    ]
+
+
+def rule_id(rule: Dict) -> str:
+    """Retrieves the Azure resource ID of a rule, or its name if it has none."""
+    return rule.get("id") or rule["name"]
+
+
+def _source_networks(rule: Dict) -> Tuple[List, bool]:
+    """Parses the source prefixes of a rule into networks, and whether any of
+       them was a service tag that cannot be evaluated."""
+    prefixes = list(rule.get("source_address_prefixes") or [])
+    if rule.get("source_address_prefix"):
+        prefixes.append(rule["source_address_prefix"])
+
+    networks, unevaluated = [], False
+    for prefix in prefixes:
+        cidrs = ANY_PREFIXES.get(prefix.lower()) or SERVICE_TAG_PREFIXES.get(
+            prefix.lower(), [prefix])
+        for cidr in cidrs:
+            network = _network(cidr)
+            if network is None:
+                unevaluated = True
+            else:
+                networks.append(network)
+
+    return networks, unevaluated
+
+
+def _match(pieces: List, networks: List) -> Tuple[List, List]:
+    """Splits address ranges into the parts inside and outside networks."""
+    matched, unmatched = [], list(pieces)
+    for network in networks:
+        remaining = []
+        for piece in unmatched:
+            if piece.version != network.version or not piece.overlaps(
+                    network):
+                remaining.append(piece)
+            elif piece.subnet_of(network):
+                matched.append(piece)
+            else:
+                matched.append(network)
+                remaining.extend(piece.address_exclude(network))
+        unmatched = remaining
+
+    return matched, unmatched
+
+
+def _network(prefix: str):
+    try:
+        return ipaddress.ip_network(prefix, strict=False)
+    except ValueError:
+        return None
+
+
+def _port_ranges(rule: Dict) -> List[str]:
+    port_ranges = list(rule.get("destination_port_ranges") or [])
+    if rule.get("destination_port_range"):
+        port_ranges.append(rule["destination_port_range"])
+    return port_ranges
+
+
+def _port_range_contains(port_range: str, port: int) -> bool:
+    """Checks an NSG port range such as "25", "20-30" or "*" for a port."""
+    port_range = port_range.strip()
+    if port_range == "*":
+        return True
+
+    first, _, last = port_range.partition("-")
+    try:
+        return int(first) <= port <= int(last or first)
+    except ValueError:
+        return False
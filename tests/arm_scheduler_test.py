@@ -0,0 +1,211 @@
+import pytest
+from munch import munchify
+
+from nsg_checker.arm_scheduler import (ArmRequestScheduler, NOT_MODIFIED,
+                                       status_code_of)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeCloudError(Exception):
+    def __init__(self, status_code, headers):
+        super().__init__(f"Status {status_code}")
+        self.status_code = status_code
+        self.response = munchify({
+            "status_code": status_code,
+            "headers": headers
+        })
+
+
+class FakeArmEndpoint:
+    """Fake ARM endpoint that allows `limit` reads per window and throttles
+    with a Retry-After until the window resets."""
+    def __init__(self, clock, limit, window=10):
+        self.clock = clock
+        self.limit = limit
+        self.window = window
+        self.window_start = 0.0
+        self.used = 0
+        self.throttled = 0
+        self.calls = []
+
+    def get(self, rgp_name, nsg_name, raw=False):
+        if self.clock() - self.window_start >= self.window:
+            self.window_start = self.clock()
+            self.used = 0
+
+        if self.used >= self.limit:
+            self.throttled += 1
+            retry_after = self.window_start + self.window - self.clock()
+            raise FakeCloudError(429,
+                                 {"Retry-After": str(int(retry_after) + 1)})
+
+        self.used += 1
+        self.calls.append((rgp_name, nsg_name, raw))
+        remaining = self.limit - self.used
+        return munchify({
+            "output": {
+                "name": nsg_name
+            },
+            "response": {
+                "headers": {
+                    "x-ms-ratelimit-remaining-subscription-reads":
+                    str(remaining),
+                    "x-ms-ratelimit-remaining-tenant-reads": "11999"
+                }
+            }
+        })
+
+
+def create_scheduler(clock, **kwargs):
+    return ArmRequestScheduler("tenant",
+                               "subscription",
+                               clock=clock,
+                               sleep=clock.sleep,
+                               **kwargs)
+
+
+def test_call_returns_output_of_raw_response():
+    clock = FakeClock()
+    endpoint = FakeArmEndpoint(clock, limit=10)
+    scheduler = create_scheduler(clock)
+
+    result = scheduler.call(endpoint.get, "rgp", "nsg")
+
+    assert result.name == "nsg"
+    assert endpoint.calls == [("rgp", "nsg", True)]
+
+
+def test_remaining_header_limits_burst():
+    clock = FakeClock()
+    endpoint = FakeArmEndpoint(clock, limit=5, window=60)
+    scheduler = create_scheduler(clock, rate=1.0, capacity=100)
+
+    for number in range(8):
+        scheduler.call(endpoint.get, "rgp", f"nsg-{number}")
+
+    assert len(endpoint.calls) == 8
+    assert clock.sleeps
+
+
+def test_throttled_calls_honour_retry_after():
+    clock = FakeClock()
+    endpoint = FakeArmEndpoint(clock, limit=3, window=10)
+    scheduler = create_scheduler(clock, rate=100.0, capacity=100)
+
+    for number in range(10):
+        scheduler.call(endpoint.get, "rgp", f"nsg-{number}")
+
+    assert len(endpoint.calls) == 10
+    assert endpoint.throttled <= 3
+    assert clock.now >= 30
+
+
+def test_throttling_halves_the_rate():
+    clock = FakeClock()
+    scheduler = create_scheduler(clock, rate=10.0)
+    bucket = scheduler.bucket("subscription", "subscription")
+
+    bucket.throttled(5)
+
+    assert bucket.rate == 5.0
+    assert bucket.reserve() >= 5
+
+
+def test_bucket_rates_are_configurable():
+    clock = FakeClock()
+    scheduler = create_scheduler(clock,
+                                 rate=10.0,
+                                 min_rate=4.0,
+                                 rate_increase=1.0)
+    bucket = scheduler.bucket("subscription", "subscription")
+
+    bucket.throttled(0)
+    bucket.throttled(0)
+
+    assert bucket.rate == 4.0
+
+    bucket.succeeded()
+
+    assert bucket.rate == 5.0
+
+
+def test_http_date_retry_after_uses_wall_clock():
+    clock = FakeClock()
+    responses = [
+        FakeCloudError(429, {"Retry-After": "Wed, 21 Oct 2015 07:28:30 GMT"})
+    ]
+
+    def throttled_once(*args, **kwargs):
+        if responses:
+            raise responses.pop()
+        return munchify({"output": "ok", "response": {"headers": {}}})
+
+    # 2015-10-21T07:28:00Z, thirty seconds before the Retry-After date
+    scheduler = create_scheduler(clock, wall_clock=lambda: 1445412480.0)
+
+    assert scheduler.call(throttled_once) == "ok"
+    assert clock.sleeps == [30.0]
+
+
+def test_not_modified_is_a_success():
+    clock = FakeClock()
+    scheduler = create_scheduler(clock, rate=10.0)
+    bucket = scheduler.bucket("subscription", "subscription")
+    bucket.throttled(0)
+
+    def not_modified(*args, **kwargs):
+        raise FakeCloudError(
+            304, {"x-ms-ratelimit-remaining-subscription-reads": "3"})
+
+    assert scheduler.call(not_modified, "rgp", "nsg") is NOT_MODIFIED
+    assert bucket.tokens <= 3
+    assert bucket.rate > 5.0
+
+
+def test_buckets_are_per_subscription():
+    clock = FakeClock()
+    scheduler = create_scheduler(clock)
+
+    assert scheduler.bucket("subscription", "a") is scheduler.bucket(
+        "subscription", "a")
+    assert scheduler.bucket("subscription", "a") is not scheduler.bucket(
+        "subscription", "b")
+
+
+def test_retries_are_exhausted():
+    clock = FakeClock()
+    endpoint = FakeArmEndpoint(clock, limit=0)
+    scheduler = create_scheduler(clock, max_retries=2)
+
+    with pytest.raises(FakeCloudError):
+        scheduler.call(endpoint.get, "rgp", "nsg")
+
+    assert endpoint.throttled == 3
+
+
+def test_other_errors_are_not_retried():
+    clock = FakeClock()
+    scheduler = create_scheduler(clock)
+    calls = []
+
+    def not_found(*args, **kwargs):
+        calls.append(args)
+        raise FakeCloudError(404, {})
+
+    with pytest.raises(FakeCloudError):
+        scheduler.call(not_found, "rgp", "nsg")
+
+    assert len(calls) == 1
+    assert status_code_of(FakeCloudError(404, {})) == 404
@@ -0,0 +1,126 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+
+from nsg_checker.cidr_history import CidrHistoryStore
+
+START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+def week(number):
+    return START + timedelta(weeks=number)
+
+
+def test_state_at_returns_snapshot(tmp_path):
+    store = CidrHistoryStore(str(tmp_path))
+
+    store.record("o365", {"40.92.0.0/15", "40.107.0.0/16"}, week(0))
+    store.record("o365", {"40.92.0.0/15", "52.100.0.0/14"}, week(1))
+
+    assert store.state_at("o365", week(0)) == {
+        "40.92.0.0/15", "40.107.0.0/16"
+    }
+    assert store.state_at("o365", week(1) + timedelta(days=3)) == {
+        "40.92.0.0/15", "52.100.0.0/14"
+    }
+
+
+def test_state_before_first_snapshot_is_empty(tmp_path):
+    store = CidrHistoryStore(str(tmp_path))
+
+    store.record("o365", {"40.92.0.0/15"}, week(1))
+
+    assert store.state_at("o365", week(0)) == set()
+
+
+def test_unchanged_snapshot_is_skipped(tmp_path):
+    store = CidrHistoryStore(str(tmp_path))
+
+    assert store.record("gsuite", {"35.190.247.0/24"}, week(0))
+    assert not store.record("gsuite", {"35.190.247.0/24"}, week(1))
+
+
+def test_older_snapshot_is_rejected(tmp_path):
+    store = CidrHistoryStore(str(tmp_path))
+
+    store.record("gsuite", {"35.190.247.0/24"}, week(1))
+
+    with pytest.raises(ValueError):
+        store.record("gsuite", {"64.233.160.0/19"}, week(0))
+
+
+def test_diff_between_dates(tmp_path):
+    store = CidrHistoryStore(str(tmp_path))
+
+    store.record("o365", {"1.1.1.0/24", "2.2.2.0/24"}, week(0))
+    store.record("o365", {"1.1.1.0/24", "3.3.3.0/24"}, week(1))
+    store.record("o365", {"3.3.3.0/24", "4.4.4.0/24"}, week(2))
+
+    assert store.diff("o365", week(0), week(2)) == ({
+        "3.3.3.0/24", "4.4.4.0/24"
+    }, {"1.1.1.0/24", "2.2.2.0/24"})
+
+
+def test_changes_between_dates(tmp_path):
+    store = CidrHistoryStore(str(tmp_path))
+
+    store.record("o365", {"1.1.1.0/24"}, week(0))
+    store.record("o365", {"1.1.1.0/24", "2.2.2.0/24"}, week(1))
+    store.record("o365", {"2.2.2.0/24"}, week(2))
+
+    assert list(store.changes("o365", week(0), week(2))) == [
+        (week(1), {"2.2.2.0/24"}, set()),
+        (week(2), set(), {"1.1.1.0/24"}),
+    ]
+
+
+def test_state_across_checkpoints_after_reload(tmp_path):
+    store = CidrHistoryStore(str(tmp_path), checkpoint_interval=3)
+    expected = {}
+
+    for number in range(10):
+        cidrs = {f"10.{number}.0.0/16", f"10.{number + 1}.0.0/16"}
+        store.record("azure/rgp/nsg/o365", cidrs, week(number))
+        expected[number] = cidrs
+
+    reloaded = CidrHistoryStore(str(tmp_path), checkpoint_interval=3)
+
+    for number, cidrs in expected.items():
+        assert reloaded.state_at("azure/rgp/nsg/o365", week(number)) == cidrs
+
+    assert reloaded.sources() == ["azure/rgp/nsg/o365"]
+
+
+def test_similar_source_names_do_not_collide(tmp_path):
+    store = CidrHistoryStore(str(tmp_path))
+
+    store.record("azure/a/b", {"1.1.1.0/24"}, week(0))
+    store.record("azure_a_b", {"2.2.2.0/24"}, week(0))
+
+    assert store.state_at("azure/a/b", week(0)) == {"1.1.1.0/24"}
+    assert store.state_at("azure_a_b", week(0)) == {"2.2.2.0/24"}
+    assert store.sources() == ["azure/a/b", "azure_a_b"]
+
+
+def test_empty_snapshot_over_state_is_refused(tmp_path):
+    store = CidrHistoryStore(str(tmp_path))
+
+    store.record("o365", {"1.1.1.0/24"}, week(0))
+
+    assert not store.record("o365", set(), week(1))
+    assert store.state_at("o365", week(1)) == {"1.1.1.0/24"}
+    assert store.record("o365", set(), week(2), allow_empty=True)
+    assert store.state_at("o365", week(2)) == set()
+
+
+def test_long_source_name(tmp_path):
+    source = ("azure/subscriptions/00000000-0000-0000-0000-000000000000"
+              "/resourceGroups/" + "r" * 90 +
+              "/providers/Microsoft.Network/networkSecurityGroups/" + "n" * 80 +
+              "/o365")
+    store = CidrHistoryStore(str(tmp_path))
+
+    assert store.record(source, {"1.1.1.0/24"}, week(0))
+
+    reloaded = CidrHistoryStore(str(tmp_path))
+    assert reloaded.state_at(source, week(0)) == {"1.1.1.0/24"}
+    assert reloaded.sources() == [source]
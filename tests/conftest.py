@@ -21,39 +21,75 @@ class MockNetworkManagementClient:
         def get(*args, **kwargs):
 
             result_1 = {
+                "etag":
+                'W/"00000000-0000-0000-0000-000000000001"',
                 "security_rules": [{
                     "destination_port_ranges": ["25"],
                     "name":
                     "gsuite_Rule_1",
+                    "priority": 100,
+                    "access": "Allow",
+                    "direction": "Inbound",
                     "source_address_prefixes": ["192.168.0.1/24"]
                 }, {
                     "destination_port_ranges": ["25"],
                     "name":
                     "gsuite-smtp-192.168.1.1-24-uksprod15c439088",
+                    "priority": 110,
+                    "access": "Allow",
+                    "direction": "Inbound",
                     "source_address_prefixes": ["192.168.1.1/24"]
                 }, {
                     "destination_port_ranges": ["25"],
                     "name":
                     "o365-smtp-192.168.2.1-24-uksprod1b75e0ca7",
+                    "priority": 120,
+                    "access": "Allow",
+                    "direction": "Inbound",
                     "source_address_prefixes": ["192.168.2.1/24"]
                 }, {
                     "destination_port_ranges": ["25"],
                     "name":
                     "o365_Rule_2",
+                    "priority": 130,
+                    "access": "Allow",
+                    "direction": "Inbound",
                     "source_address_prefixes": ["192.168.3.1/24"]
                 }, {
                     "destination_port_ranges": ["25"],
                     "name":
                     "Mimecast",
+                    "priority": 140,
+                    "access": "Allow",
+                    "direction": "Inbound",
                     "source_address_prefixes": ["172.168.0.1/24"]
                 }, {
                     "destination_port_ranges": ["443"],
                     "name":
                     "O365_443_Rule_3",
+                    "priority": 150,
+                    "access": "Allow",
+                    "direction": "Inbound",
                     "source_address_prefixes": ["172.168.1.1/24"]
+                }],
+                "default_security_rules": [{
+                    "destination_port_range": "*",
+                    "name": "DenyAllInBound",
+                    "priority": 65500,
+                    "access": "Deny",
+                    "direction": "Inbound",
+                    "source_address_prefix": "*"
                 }]
             }
 
+            if kwargs.get("raw"):
+                return munchify({
+                    "output": result_1,
+                    "response": {
+                        "headers": {}
+                    }
+                })
+
             return munchify(result_1)
 
 
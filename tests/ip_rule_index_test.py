@@ -0,0 +1,298 @@
+import ipaddress
+import json
+import random
+
+import pytest
+
+from nsg_checker.__main__ import main
+from nsg_checker.ip_rule_index import IpRuleIndex
+
+NSG_1 = ("/subscriptions/sub/resourceGroups/rgp/providers"
+         "/Microsoft.Network/networkSecurityGroups/nsg-1")
+NSG_2 = ("/subscriptions/sub/resourceGroups/rgp/providers"
+         "/Microsoft.Network/networkSecurityGroups/nsg-2")
+
+NSG_1_RULES = [{
+    "name": "o365-smtp-40.92.0.0-15",
+    "priority": 100,
+    "access": "Allow",
+    "direction": "Inbound",
+    "destination_port_ranges": ["25"],
+    "source_address_prefixes": ["40.92.0.0/15", "104.47.0.0/17"]
+}, {
+    "name": "deny-all",
+    "priority": 4000,
+    "access": "Deny",
+    "direction": "Inbound",
+    "destination_port_range": "*",
+    "source_address_prefix": "*"
+}, {
+    "name": "allow-vnet",
+    "priority": 200,
+    "access": "Allow",
+    "direction": "Inbound",
+    "destination_port_range": "*",
+    "source_address_prefix": "VirtualNetwork"
+}, {
+    "name": "deny-outbound-smtp",
+    "priority": 500,
+    "access": "Deny",
+    "direction": "Outbound",
+    "destination_port_range": "25",
+    "source_address_prefix": "40.92.0.0/15"
+}]
+
+DEFAULT_RULES = [{
+    "name": "DenyAllInBound",
+    "priority": 65500,
+    "access": "Deny",
+    "direction": "Inbound",
+    "destination_port_range": "*",
+    "source_address_prefix": "*"
+}]
+
+NSG_2_RULES = [{
+    "name": "o365-smtp-40.92.1.0-24",
+    "priority": 300,
+    "access": "Allow",
+    "direction": "Inbound",
+    "destination_port_ranges": ["25"],
+    "source_address_prefixes": ["40.92.1.0/24"]
+}]
+
+
+def create_index(path=None):
+    index = IpRuleIndex(path)
+    index.update_nsg(NSG_1, 'W/"1"', NSG_1_RULES)
+    index.update_nsg(NSG_2, 'W/"1"', NSG_2_RULES, DEFAULT_RULES)
+    return index
+
+
+def rules_of(matches):
+    return [(match["nsg"], match["rule"]) for match in matches]
+
+
+def test_ip_lookup():
+    index = create_index()
+
+    assert rules_of(index.lookup("40.92.1.10")) == [
+        (NSG_1, "o365-smtp-40.92.0.0-15"),
+        (NSG_1, "deny-all"),
+        (NSG_2, "o365-smtp-40.92.1.0-24"),
+        (NSG_2, "DenyAllInBound"),
+    ]
+
+
+def test_ip_outside_rules_only_matches_any():
+    index = create_index()
+
+    assert rules_of(index.lookup("8.8.8.8")) == [(NSG_1, "deny-all"),
+                                                 (NSG_2, "DenyAllInBound")]
+
+
+def test_lookup_direction():
+    index = create_index()
+
+    assert rules_of(index.lookup("40.92.1.10", "Outbound")) == [
+        (NSG_1, "deny-outbound-smtp")
+    ]
+    assert len(index.lookup("40.92.1.10", None)) == 5
+
+
+def test_default_rules_are_flagged():
+    matches = create_index().lookup("8.8.8.8")
+
+    assert [match["default"] for match in matches] == [False, True]
+
+
+def test_cidr_lookup_includes_nested_rules():
+    index = create_index()
+
+    matches = index.lookup("40.92.0.0/16")
+
+    assert rules_of(matches) == [
+        (NSG_1, "o365-smtp-40.92.0.0-15"),
+        (NSG_1, "deny-all"),
+        (NSG_2, "o365-smtp-40.92.1.0-24"),
+        (NSG_2, "DenyAllInBound"),
+    ]
+    assert matches[0]["access"] == "Allow"
+    assert matches[0]["priority"] == 100
+    assert matches[1]["ports"] == ["*"]
+
+
+def test_ipv6_lookup():
+    index = create_index()
+
+    assert rules_of(index.lookup("2a01:111:f400::1")) == [
+        (NSG_1, "deny-all"), (NSG_2, "DenyAllInBound")
+    ]
+
+
+def test_internet_tag_matches_every_address():
+    index = create_index()
+    index.update_nsg(NSG_2, 'W/"2"', [{
+        "name": "allow-internet-smtp",
+        "priority": 100,
+        "access": "Allow",
+        "direction": "Inbound",
+        "destination_port_range": "25",
+        "source_address_prefix": "Internet"
+    }])
+
+    matches = index.lookup("8.8.8.8")
+
+    assert rules_of(matches) == [(NSG_1, "deny-all"),
+                                 (NSG_2, "allow-internet-smtp")]
+    assert [match["service_tag"] for match in matches] == [None, "Internet"]
+    assert rules_of(index.lookup("2a01:111:f400::1")) == [
+        (NSG_1, "deny-all"), (NSG_2, "allow-internet-smtp")
+    ]
+
+
+def test_other_service_tags_are_skipped(tmp_path):
+    path = str(tmp_path / "index.json")
+    create_index(path).save()
+
+    index = IpRuleIndex(path)
+
+    assert [(entry["nsg"], entry["rule"], entry["prefix"])
+            for entry in index.skipped()] == [(NSG_1, "allow-vnet",
+                                               "VirtualNetwork")]
+    assert index.skipped("Outbound") == []
+
+    index.remove_nsg(NSG_1)
+
+    assert index.skipped() == []
+
+
+def test_update_nsg_skips_unchanged_etag():
+    index = create_index()
+
+    assert not index.update_nsg(NSG_2, 'W/"1"', [])
+    assert index.update_nsg(NSG_2, 'W/"2"', [])
+    assert index.etag(NSG_2) == 'W/"2"'
+    assert rules_of(index.lookup("40.92.1.10")) == [
+        (NSG_1, "o365-smtp-40.92.0.0-15"),
+        (NSG_1, "deny-all"),
+    ]
+
+
+def test_remove_nsg():
+    index = create_index()
+
+    index.remove_nsg(NSG_1)
+    index.remove_nsg(NSG_2)
+
+    assert index.lookup("8.8.8.8") == []
+    assert index.etag(NSG_1) is None
+
+
+def test_invalid_address():
+    with pytest.raises(ValueError):
+        create_index().lookup("not-an-ip")
+
+
+def test_index_persists(tmp_path):
+    path = str(tmp_path / "index.json")
+    create_index(path).save()
+
+    index = IpRuleIndex(path)
+
+    assert index.etag(NSG_1) == 'W/"1"'
+    assert len(index.lookup("40.92.1.10")) == 4
+    assert index.update_nsg(NSG_1, 'W/"2"', NSG_1_RULES[:1])
+    assert rules_of(index.lookup("8.8.8.8")) == [(NSG_2, "DenyAllInBound")]
+
+
+def test_other_index_versions_are_discarded(tmp_path):
+    path = tmp_path / "index.json"
+    path.write_text(
+        json.dumps({"rgp/nsg-1": {
+            "etag": 'W/"1"',
+            "entries": []
+        }}))
+
+    assert IpRuleIndex(str(path)).etag("rgp/nsg-1") is None
+
+
+def test_updates_match_a_full_scan():
+    generator = random.Random(25)
+    index = IpRuleIndex()
+    nsgs = {}
+
+    for update in range(200):
+        nsg_id = f"nsg-{generator.randrange(10)}"
+        rules = [{
+            "name": f"rule-{number}",
+            "direction": "Inbound",
+            "source_address_prefix":
+            f"10.{generator.randrange(4)}.{generator.randrange(4) * 64}.0/"
+            f"{generator.choice([8, 16, 18, 24])}"
+        } for number in range(generator.randrange(4))]
+        index.update_nsg(nsg_id, f'W/"{update}"', rules)
+        nsgs[nsg_id] = rules
+
+    for address in ["10.0.0.1", "10.1.64.0/18", "10.3.200.7", "11.0.0.1"]:
+        network = ipaddress.ip_network(address, strict=False)
+        expected = sorted((nsg_id, rule["name"])
+                          for nsg_id, rules in nsgs.items() for rule in rules
+                          if ipaddress.ip_network(
+                              rule["source_address_prefix"], strict=False)
+                          .overlaps(network))
+
+        assert sorted(rules_of(index.lookup(address))) == expected
+
+
+def test_cli_lookup(tmp_path, capsys):
+    path = str(tmp_path / "index.json")
+    create_index(path).save()
+
+    exit_code = main(["lookup", "--index", path, "40.92.1.10"])
+    lines = capsys.readouterr().out.splitlines()
+
+    assert exit_code == 0
+    assert lines[0] == (f"40.92.1.10\t{NSG_1}\to365-smtp-40.92.0.0-15\t100"
+                        "\tAllow\tInbound\t40.92.0.0/15\t25")
+    assert len(lines) == 5
+    assert lines[-1] == (f"40.92.1.10\t{NSG_1}\tallow-vnet\t200\tAllow"
+                         "\tInbound\tVirtualNetwork\t*\tnot evaluated")
+
+
+def test_cli_lookup_direction(tmp_path, capsys):
+    path = str(tmp_path / "index.json")
+    create_index(path).save()
+
+    main(["lookup", "--index", path, "--direction", "any", "40.92.1.10"])
+
+    assert len(capsys.readouterr().out.splitlines()) == 6
+
+
+def test_cli_lookup_without_matches(tmp_path, capsys):
+    path = str(tmp_path / "index.json")
+    IpRuleIndex(path).save()
+
+    exit_code = main(["lookup", "--index", path, "8.8.8.8"])
+
+    assert exit_code == 1
+    assert capsys.readouterr().out == "8.8.8.8\tno matching rules\n"
+
+
+def test_cli_lookup_invalid_address(tmp_path, capsys):
+    path = str(tmp_path / "index.json")
+    create_index(path).save()
+
+    exit_code = main(["lookup", "--index", path, "not-an-ip", "40.92.1.10"])
+    output = capsys.readouterr()
+
+    assert exit_code == 1
+    assert output.err == "not-an-ip\tnot an IP address or CIDR\n"
+    assert output.out.startswith("40.92.1.10\t")
+
+
+def test_cli_lookup_missing_index(tmp_path, capsys):
+    with pytest.raises(SystemExit) as error:
+        main(["lookup", "--index", str(tmp_path / "missing.json"), "8.8.8.8"])
+
+    assert error.value.code == 2
+    assert "does not exist" in capsys.readouterr().err
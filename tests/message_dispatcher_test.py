@@ -1,6 +1,6 @@
 import pytest
 from mock import Mock, patch
-from nsg_checker.message_dispatcher import MessageDispatcher
+from nsg_checker.message_dispatcher import MessageDispatcher, ProviderResult
 
 
 def test_missing_o365():
@@ -14,9 +14,10 @@ def test_missing_o365():
 
     gsuite_azure_rules = set()
 
-    dispatch = MessageDispatcher(o365_rules, gsuite_rules, o365_azure_rules,
-                                 gsuite_azure_rules, "12343",
-                                 "azure-nsg-checker")
+    dispatch = MessageDispatcher.from_rule_sets(o365_rules, gsuite_rules,
+                                                o365_azure_rules,
+                                                gsuite_azure_rules, "12343",
+                                                "azure-nsg-checker")
 
     assert dispatch.missing_o365 == {"192.168.3.1/24"}
 
@@ -36,9 +37,10 @@ def test_extra_gsuite():
         "200.168.0.1/24", "200.168.1.1/24", "200.168.2.1/24", "200.168.3.1/24"
     }
 
-    dispatch = MessageDispatcher(o365_rules, gsuite_rules, o365_azure_rules,
-                                 gsuite_azure_rules, "12343",
-                                 "azure-nsg-checker")
+    dispatch = MessageDispatcher.from_rule_sets(o365_rules, gsuite_rules,
+                                                o365_azure_rules,
+                                                gsuite_azure_rules, "12343",
+                                                "azure-nsg-checker")
 
     assert dispatch.extra_gsuite == {"200.168.3.1/24"}
 
@@ -58,9 +60,10 @@ def test_message_extra_gsuite():
         "200.168.0.1/24", "200.168.1.1/24", "200.168.2.1/24", "200.168.3.1/24"
     }
 
-    dispatch = MessageDispatcher(o365_rules, gsuite_rules, o365_azure_rules,
-                                 gsuite_azure_rules, "12343",
-                                 "azure-nsg-checker")
+    dispatch = MessageDispatcher.from_rule_sets(o365_rules, gsuite_rules,
+                                                o365_azure_rules,
+                                                gsuite_azure_rules, "12343",
+                                                "azure-nsg-checker")
 
     slack_text = dispatch.create_slack_message()
 
@@ -88,9 +91,10 @@ def test_message_extra_0365():
         "200.168.0.1/24", "200.168.1.1/24", "200.168.2.1/24", "200.168.3.1/24"
     }
 
-    dispatch = MessageDispatcher(o365_rules, gsuite_rules, o365_azure_rules,
-                                 gsuite_azure_rules, "12343",
-                                 "azure-nsg-checker")
+    dispatch = MessageDispatcher.from_rule_sets(o365_rules, gsuite_rules,
+                                                o365_azure_rules,
+                                                gsuite_azure_rules, "12343",
+                                                "azure-nsg-checker")
 
     slack_text = dispatch.create_slack_message()
 
@@ -114,9 +118,10 @@ def test_no_extra_message():
 
     gsuite_azure_rules = {"200.168.0.1/24", "200.168.1.1/24", "200.168.2.1/24"}
 
-    dispatch = MessageDispatcher(o365_rules, gsuite_rules, o365_azure_rules,
-                                 gsuite_azure_rules, "12343",
-                                 "azure-nsg-checker")
+    dispatch = MessageDispatcher.from_rule_sets(o365_rules, gsuite_rules,
+                                                o365_azure_rules,
+                                                gsuite_azure_rules, "12343",
+                                                "azure-nsg-checker")
 
     slack_text = dispatch.create_slack_message()
 
@@ -138,9 +143,10 @@ def test_missing_o365_message():
 
     gsuite_azure_rules = {"200.168.0.1/24", "200.168.1.1/24", "200.168.2.1/24"}
 
-    dispatch = MessageDispatcher(o365_rules, gsuite_rules, o365_azure_rules,
-                                 gsuite_azure_rules, "12343",
-                                 "azure-nsg-checker")
+    dispatch = MessageDispatcher.from_rule_sets(o365_rules, gsuite_rules,
+                                                o365_azure_rules,
+                                                gsuite_azure_rules, "12343",
+                                                "azure-nsg-checker")
 
     slack_text = dispatch.create_slack_message()
 
@@ -162,9 +168,10 @@ def test_missing_gsuite_message():
 
     gsuite_azure_rules = {"200.168.0.1/24", "200.168.1.1/24", "200.168.2.1/24"}
 
-    dispatch = MessageDispatcher(o365_rules, gsuite_rules, o365_azure_rules,
-                                 gsuite_azure_rules, "12343",
-                                 "azure-nsg-checker")
+    dispatch = MessageDispatcher.from_rule_sets(o365_rules, gsuite_rules,
+                                                o365_azure_rules,
+                                                gsuite_azure_rules, "12343",
+                                                "azure-nsg-checker")
 
     slack_text = dispatch.create_slack_message()
 
@@ -188,10 +195,42 @@ def test_dispatch_runs(mock_slack_client, mock_log):
         "200.168.0.1/24", "200.168.1.1/24", "200.168.2.1/24", "200.168.3.1/24"
     }
 
-    dispatch = MessageDispatcher(o365_rules, gsuite_rules, o365_azure_rules,
-                                 gsuite_azure_rules, "12343",
-                                 "azure-nsg-checker")
+    dispatch = MessageDispatcher.from_rule_sets(o365_rules, gsuite_rules,
+                                                o365_azure_rules,
+                                                gsuite_azure_rules, "12343",
+                                                "azure-nsg-checker")
 
     dispatch.dispatch_slack_message()
 
     mock_log.assert_called_with("Sent slack message to azure-nsg-checker")
+
+
+def test_message_from_provider_results():
+    provider_results = [
+        ProviderResult("o365", "O365", "O365 Exchange", {"201.168.0.1/24"},
+                       {"201.168.0.1/24"}),
+        ProviderResult("ses", "AWS", "AWS SES", {"52.95.48.0/22"},
+                       {"3.8.0.0/14"})
+    ]
+
+    dispatch = MessageDispatcher(provider_results, "12343",
+                                 "azure-nsg-checker")
+
+    slack_text = dispatch.create_slack_message()
+
+    assert dispatch.missing_gsuite == set()
+    assert slack_text == "Here is your update from the Azure NSG Watcher:\n\nNo O365 NSG rules are missing\nThese port 25 SMTP Ingress NSG rules are missing for AWS SES:\n\n\t- 52.95.48.0/22\nThese port 25 SMTP NSG rules for AWS SES are no longer needed:\n\n\t- 3.8.0.0/14"
+
+
+def test_message_for_failed_fetch():
+    provider_results = [
+        ProviderResult("o365", "O365", "O365 Exchange", None,
+                       {"201.168.0.1/24"})
+    ]
+
+    dispatch = MessageDispatcher(provider_results, "12343",
+                                 "azure-nsg-checker")
+
+    slack_text = dispatch.create_slack_message()
+
+    assert slack_text == "Here is your update from the Azure NSG Watcher:\n\nUnable to retrieve the current O365 Exchange CIDRs, its NSG rules were not checked"
@@ -0,0 +1,66 @@
+import json
+
+from nsg_checker.nsg_rule_cache import NsgRuleCache
+
+NSG_ID = ("/subscriptions/sub/resourceGroups/rgp/providers"
+          "/Microsoft.Network/networkSecurityGroups/nsg")
+
+
+def test_put_replaces_derived_data():
+    cache = NsgRuleCache()
+
+    entry = cache.put(NSG_ID, 'W/"1"', [])
+    entry.derived_value("index", lambda: "old")
+    entry = cache.put(NSG_ID, 'W/"2"', [])
+
+    assert cache.get(NSG_ID).etag == 'W/"2"'
+    assert entry.derived_value("index", lambda: "new") == "new"
+
+
+def test_derived_value_is_computed_once():
+    cache = NsgRuleCache()
+    calls = []
+
+    entry = cache.put(NSG_ID, 'W/"1"', [])
+    entry.derived_value("index", lambda: calls.append(1))
+    entry.derived_value("index", lambda: calls.append(1))
+
+    assert calls == [1]
+
+
+def test_missing_nsg_is_none():
+    assert NsgRuleCache().get(NSG_ID) is None
+
+
+def test_cache_persists(tmp_path):
+    path = str(tmp_path / "cache.json")
+    rules = [{"name": "o365-smtp", "source_address_prefixes": ["1.1.1.0/24"]}]
+    default_rules = [{"name": "DenyAllInBound", "source_address_prefix": "*"}]
+    cache = NsgRuleCache(path)
+
+    cache.put(NSG_ID, 'W/"1"', rules, default_rules)
+    cache.save()
+    entry = NsgRuleCache(path).get(NSG_ID)
+
+    assert entry.etag == 'W/"1"'
+    assert entry.rules == rules
+    assert entry.default_rules == default_rules
+
+
+def test_other_cache_versions_are_discarded(tmp_path):
+    path = tmp_path / "cache.json"
+    path.write_text(
+        json.dumps({
+            "version":
+            2,
+            "entries": [{
+                "nsg_id": NSG_ID,
+                "etag": 'W/"1"',
+                "rules": [],
+                "default_rules": [],
+                "o365": [],
+                "gsuite": []
+            }]
+        }))
+
+    assert NsgRuleCache(str(path)).get(NSG_ID) is None
@@ -10,6 +10,14 @@ from urllib.request import Request, urlopen
 from http.client import HTTPResponse
 from dns.resolver import NXDOMAIN
 
+from nsg_checker.arm_scheduler import NOT_MODIFIED
+from nsg_checker.ip_rule_index import IpRuleIndex
+from nsg_checker.providers import (FunctionProvider, ProviderFetchError,
+                                   ProviderRegistry)
+
+NSG_ID = ("/subscriptions/2222/resourceGroups/test/providers"
+          "/Microsoft.Network/networkSecurityGroups/test")
+
 
 def test_rebuild(mock_azure_network):
 
@@ -125,3 +133,113 @@ def test_gsuite_error_handling(mock_dns_resolver, mock_log,
     result = mock_azure_network.get_gsuite_smtp_ipv4_cidrs()
 
     assert result == set()
+
+
+@patch('nsg_checker.azure_nsg_checker.dns.resolver.query')
+def test_gsuite_strict_raises_on_error(mock_dns_resolver, mock_azure_network):
+    mock_dns_resolver.side_effect = NXDOMAIN()
+
+    with pytest.raises(ProviderFetchError):
+        mock_azure_network.get_gsuite_smtp_ipv4_cidrs(strict=True)
+
+
+@patch('nsg_checker.azure_nsg_checker.requests.get')
+def test_o365_strict_raises_when_not_200(mock_requests, mock_azure_network):
+    mock_http_response = Mock(spec=requests.Response)
+    mock_http_response.status_code = 503
+    mock_requests.return_value = mock_http_response
+
+    with pytest.raises(ProviderFetchError):
+        mock_azure_network.get_o365_smtp_ipv4_cidrs(strict=True)
+
+
+def test_unchanged_etag_uses_cached_rules(mock_azure_network):
+
+    first = mock_azure_network.get_azure_nsg_rule_entry("test", "test")
+    first.derived_value("index", lambda: "built")
+
+    second = mock_azure_network.get_azure_nsg_rule_entry("test", "test")
+
+    assert second is first
+    assert second.derived == {"index": "built"}
+
+
+def test_changed_etag_reparses_rules(mock_azure_network):
+
+    nsg_id = mock_azure_network.nsg_id("test", "test")
+    stale = mock_azure_network.rule_cache.put(nsg_id, 'W/"stale"', [])
+    stale.derived_value("index", lambda: "stale")
+
+    o365_result, gsuite_result = mock_azure_network.get_azure_nsg_rules(
+        "test", "test")
+    entry = mock_azure_network.rule_cache.get(nsg_id)
+
+    assert o365_result == {'192.168.2.1/24', '192.168.3.1/24'}
+    assert entry.etag == 'W/"00000000-0000-0000-0000-000000000001"'
+    assert "index" not in entry.derived
+
+
+def test_not_modified_uses_cached_rules(mock_azure_network):
+    mock_azure_network.rule_cache.put(
+        mock_azure_network.nsg_id("test", "test"), 'W/"cached"', [{
+            "name": "o365-smtp-10.0.0.0-8",
+            "destination_port_ranges": ["25"],
+            "source_address_prefixes": ["10.0.0.0/8"]
+        }])
+    mock_azure_network.scheduler = Mock()
+    mock_azure_network.scheduler.call.return_value = NOT_MODIFIED
+
+    o365_result, gsuite_result = mock_azure_network.get_azure_nsg_rules(
+        "test", "test")
+    custom_headers = mock_azure_network.scheduler.call.call_args[1][
+        "custom_headers"]
+
+    assert o365_result == {"10.0.0.0/8"}
+    assert custom_headers == {"If-None-Match": 'W/"cached"'}
+
+
+def test_rule_index_is_updated(mock_azure_network):
+    mock_azure_network.rule_index = IpRuleIndex()
+
+    mock_azure_network.get_azure_nsg_rules("test", "test")
+
+    matches = mock_azure_network.rule_index.lookup("192.168.2.10")
+
+    assert [(match["nsg"], match["rule"], match["default"])
+            for match in matches] == [
+                (NSG_ID, "o365-smtp-192.168.2.1-24-uksprod1b75e0ca7", False),
+                (NSG_ID, "DenyAllInBound", True),
+            ]
+
+
+def test_nsg_id_includes_subscription(mock_azure_network):
+
+    assert mock_azure_network.nsg_id("test", "test") == NSG_ID
+    assert mock_azure_network.get_azure_nsg_rule_entry(
+        "test", "test") is mock_azure_network.rule_cache.get(NSG_ID)
+
+
+def test_azure_nsg_rules_use_registry_tags(mock_azure_network):
+    mock_azure_network.registry = mock_azure_network.default_registry(
+        o365_tag="mimecast")
+
+    o365_result, gsuite_result = mock_azure_network.get_azure_nsg_rules(
+        "test", "test")
+
+    assert o365_result == {"172.168.0.1/24"}
+    assert gsuite_result == {"192.168.0.1/24", "192.168.1.1/24"}
+
+
+def test_get_provider_rules_by_tag(mock_azure_network):
+    registry = ProviderRegistry()
+    registry.register(FunctionProvider("o365", "O365", "O365 Exchange", set))
+    registry.register(
+        FunctionProvider("mimecast", "MIMECAST", "Mimecast", set))
+
+    result = mock_azure_network.get_azure_nsg_provider_rules(
+        "test", "test", registry)
+
+    assert [rule["name"] for rule in result["o365"]] == [
+        "o365-smtp-192.168.2.1-24-uksprod1b75e0ca7", "o365_Rule_2"
+    ]
+    assert [rule["name"] for rule in result["mimecast"]] == ["Mimecast"]
@@ -0,0 +1,261 @@
+import json
+
+import pytest
+import requests
+from mock import Mock, patch
+
+from nsg_checker.providers import (AwsIpRangesIndex, AwsIpRangesProvider,
+                                   FunctionProvider, ProviderFetchError,
+                                   ProviderRegistry, rule_prefixes, rule_tag)
+
+IP_RANGES = {
+    "syncToken":
+    "1600000000",
+    "prefixes": [{
+        "ip_prefix": "52.95.48.0/22",
+        "region": "eu-west-2",
+        "service": "AMAZON"
+    }, {
+        "ip_prefix": "3.8.0.0/14",
+        "region": "eu-west-2",
+        "service": "EC2"
+    }, {
+        "ip_prefix": "18.200.0.0/16",
+        "region": "eu-west-1",
+        "service": "EC2"
+    }],
+    "ipv6_prefixes": [{
+        "ipv6_prefix": "2a05:d01c::/40",
+        "region": "eu-west-2",
+        "service": "EC2"
+    }]
+}
+
+
+def create_registry(*providers):
+    registry = ProviderRegistry()
+    for provider in providers:
+        registry.register(provider)
+    return registry
+
+
+def test_rule_tag_from_name():
+    assert rule_tag({"name": "o365-smtp-192.168.2.1-24"}) == "o365"
+    assert rule_tag({"name": "GSUITE_Rule_1"}) == "gsuite"
+
+
+def test_rule_tag_from_description():
+    assert rule_tag({
+        "name": "allow-smtp-1",
+        "description": "Mimecast relays nsg-checker:mimecast"
+    }) == "mimecast"
+
+
+def test_match_rule_by_tag_and_port():
+    registry = create_registry(
+        FunctionProvider("o365", "O365", "O365 Exchange", set),
+        FunctionProvider("ses", "SES", "AWS SES", set, tag="aws"))
+
+    assert registry.match_rule({
+        "name": "aws-smtp-1",
+        "destination_port_ranges": ["25"]
+    }) is registry.get("ses")
+    assert registry.match_rule({
+        "name": "o365-https",
+        "destination_port_ranges": ["443"]
+    }) is None
+    assert registry.match_rule({
+        "name": "allow-o365-smtp",
+        "destination_port_ranges": ["25"]
+    }) is None
+
+
+def test_classify_rules():
+    registry = create_registry(
+        FunctionProvider("o365", "O365", "O365 Exchange", set),
+        FunctionProvider("gsuite", "GSUITE", "GSUITE Gmail", set))
+    rules = [{
+        "name": "o365-smtp-1",
+        "destination_port_range": "25",
+        "source_address_prefix": "40.92.0.0/15"
+    }, {
+        "name": "Mimecast",
+        "destination_port_ranges": ["25"],
+        "source_address_prefixes": ["172.168.0.1/24"]
+    }]
+
+    result = registry.classify(rules)
+
+    assert result == {"o365": [rules[0]], "gsuite": []}
+    assert rule_prefixes(result["o365"]) == {"40.92.0.0/15"}
+
+
+def test_register_rejects_duplicate_tag():
+    registry = create_registry(FunctionProvider("o365", "O365", "O365", set))
+
+    with pytest.raises(ValueError):
+        registry.register(
+            FunctionProvider("exchange", "O365", "O365", set, tag="O365"))
+
+
+def test_provider_cache_respects_ttl():
+    now = [0.0]
+    fetch = Mock(return_value={"40.92.0.0/15"})
+    provider = FunctionProvider("o365",
+                                "O365",
+                                "O365 Exchange",
+                                fetch,
+                                ttl=60,
+                                clock=lambda: now[0])
+
+    provider.cidrs()
+    now[0] = 30
+    provider.cidrs()
+    now[0] = 61
+    provider.cidrs()
+
+    assert fetch.call_count == 2
+
+
+def test_fetch_all():
+    registry = create_registry(
+        FunctionProvider("o365", "O365", "O365 Exchange",
+                         lambda: {"40.92.0.0/15"}),
+        FunctionProvider("gsuite", "GSUITE", "GSUITE Gmail",
+                         lambda: {"35.190.247.0/24"}))
+
+    assert registry.fetch_all() == {
+        "o365": {"40.92.0.0/15"},
+        "gsuite": {"35.190.247.0/24"}
+    }
+
+
+def test_aws_index_query():
+    index = AwsIpRangesIndex(IP_RANGES)
+
+    assert index.query(regions=["eu-west-2"], services=["EC2"]) == {
+        "3.8.0.0/14"
+    }
+    assert index.query(services=["EC2"]) == {"3.8.0.0/14", "18.200.0.0/16"}
+    assert index.query(regions=["eu-west-2"], version=6) == {"2a05:d01c::/40"}
+    assert index.query(regions=["us-east-1"]) == set()
+
+
+@patch('nsg_checker.providers.requests.get')
+def test_aws_provider_reuses_index(mock_requests):
+    mock_http_response = Mock(spec=requests.Response)
+    mock_http_response.status_code = 200
+    mock_http_response.text = json.dumps(IP_RANGES)
+    mock_http_response.headers = {"ETag": '"1"'}
+    mock_requests.return_value = mock_http_response
+    provider = AwsIpRangesProvider(regions=["eu-west-2"], ttl=0)
+
+    assert provider.cidrs() == {"52.95.48.0/22", "3.8.0.0/14"}
+    index = provider.index
+    mock_http_response.text = "not parsed"
+    provider.cidrs()
+
+    assert provider.index is index
+
+
+@patch('nsg_checker.providers.requests.get')
+def test_aws_provider_not_modified(mock_requests):
+    mock_http_response = Mock(spec=requests.Response)
+    mock_http_response.status_code = 200
+    mock_http_response.text = json.dumps(IP_RANGES)
+    mock_http_response.headers = {
+        "ETag": '"1"',
+        "Last-Modified": "Mon, 01 Jun 2020 00:00:00 GMT"
+    }
+    mock_requests.return_value = mock_http_response
+    provider = AwsIpRangesProvider(regions=["eu-west-2"], ttl=0)
+    provider.cidrs()
+    mock_http_response.status_code = 304
+
+    assert provider.cidrs() == {"52.95.48.0/22", "3.8.0.0/14"}
+    assert mock_requests.call_args[1]["headers"] == {
+        "If-None-Match": '"1"',
+        "If-Modified-Since": "Mon, 01 Jun 2020 00:00:00 GMT"
+    }
+
+
+@patch('nsg_checker.providers.requests.get')
+def test_aws_provider_not_200(mock_requests):
+    mock_http_response = Mock(spec=requests.Response)
+    mock_http_response.status_code = 500
+    mock_requests.return_value = mock_http_response
+
+    with pytest.raises(ProviderFetchError):
+        AwsIpRangesProvider().cidrs()
+
+
+@patch('nsg_checker.providers.requests.get')
+def test_aws_provider_connection_error(mock_requests):
+    mock_requests.side_effect = requests.ConnectionError("Connection refused")
+
+    with pytest.raises(ProviderFetchError):
+        AwsIpRangesProvider(timeout=5).cidrs()
+    assert mock_requests.call_args[1]["timeout"] == 5
+
+
+@patch('nsg_checker.providers.requests.get')
+def test_aws_provider_invalid_json(mock_requests):
+    mock_http_response = Mock(spec=requests.Response)
+    mock_http_response.status_code = 200
+    mock_http_response.text = "<html>"
+    mock_http_response.headers = {}
+    mock_requests.return_value = mock_http_response
+
+    with pytest.raises(ProviderFetchError):
+        AwsIpRangesProvider().cidrs()
+
+
+def test_fetch_all_request_errors_are_none():
+    def unreachable():
+        raise requests.ConnectionError("Connection refused")
+
+    def invalid_json():
+        return json.loads("<html>")
+
+    registry = create_registry(
+        FunctionProvider("o365", "O365", "O365 Exchange", unreachable),
+        FunctionProvider("gsuite", "GSUITE", "GSUITE Gmail", invalid_json))
+
+    assert registry.fetch_all() == {"o365": None, "gsuite": None}
+
+
+def test_fetch_all_failed_provider_is_none():
+    def failing_fetch():
+        raise ProviderFetchError("Timeout")
+
+    registry = create_registry(
+        FunctionProvider("o365", "O365", "O365 Exchange", failing_fetch),
+        FunctionProvider("gsuite", "GSUITE", "GSUITE Gmail",
+                         lambda: {"35.190.247.0/24"}))
+
+    assert registry.fetch_all() == {
+        "o365": None,
+        "gsuite": {"35.190.247.0/24"}
+    }
+
+
+def test_classify_logs_untagged_smtp_rules(caplog):
+    registry = create_registry(
+        FunctionProvider("o365", "O365", "O365 Exchange", set))
+
+    registry.classify([{
+        "name": "partner-smtp",
+        "direction": "Inbound",
+        "access": "Allow",
+        "destination_port_ranges": ["25"]
+    }, {
+        "name": "partner-https",
+        "direction": "Inbound",
+        "access": "Allow",
+        "destination_port_ranges": ["443"]
+    }])
+
+    assert [record.getMessage() for record in caplog.records] == [
+        "NSG rule partner-smtp tagged partner matches no provider and is not "
+        "checked."
+    ]
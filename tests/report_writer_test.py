@@ -0,0 +1,234 @@
+import gzip
+import json
+
+from nsg_checker.report_writer import (JsonLinesReportWriter,
+                                       evaluate_access, smtp_rules)
+
+RULES = [{
+    "id": "/nsg/securityRules/o365-smtp-40.92.0.0-15",
+    "name": "o365-smtp-40.92.0.0-15",
+    "priority": 100,
+    "direction": "Inbound",
+    "access": "Allow",
+    "destination_port_range": "25",
+    "source_address_prefixes": ["40.92.0.0/15"]
+}, {
+    "id": None,
+    "name": "o365_Rule_2",
+    "priority": 200,
+    "direction": "Inbound",
+    "access": "Allow",
+    "destination_port_ranges": ["25", "587"],
+    "source_address_prefixes": ["104.47.0.0/17", "Internet"]
+}]
+
+NSG_RULES = RULES + [{
+    "id": "/nsg/securityRules/partners-smtp",
+    "name": "partners-smtp",
+    "priority": 120,
+    "direction": "Inbound",
+    "access": "Allow",
+    "destination_port_range": "20-30",
+    "source_address_prefixes": ["52.96.0.0/12"]
+}, {
+    "id": "/nsg/securityRules/deny-13.107",
+    "name": "deny-13.107",
+    "priority": 150,
+    "direction": "Inbound",
+    "access": "Deny",
+    "destination_port_range": "*",
+    "source_address_prefix": "13.107.0.0/16"
+}, {
+    "id": "/nsg/securityRules/https",
+    "name": "https",
+    "priority": 110,
+    "direction": "Inbound",
+    "access": "Allow",
+    "destination_port_range": "443",
+    "source_address_prefix": "*"
+}]
+
+
+def test_write_result_record(tmp_path):
+    path = str(tmp_path / "report.jsonl")
+
+    with JsonLinesReportWriter(path) as writer:
+        writer.write_result(
+            "rgp/nsg", "o365", {
+                "13.107.6.0/24", "40.92.0.0/15", "40.93.0.0/16",
+                "52.100.0.0/14", "8.8.8.0/24"
+            }, {"40.92.0.0/15", "104.47.0.0/17"}, RULES, NSG_RULES)
+
+    with open(path) as report:
+        records = [json.loads(line) for line in report]
+
+    assert records == [{
+        "nsg": "rgp/nsg",
+        "provider": "o365",
+        "fetch_failed": False,
+        "missing":
+        ["13.107.6.0/24", "40.93.0.0/16", "52.100.0.0/14", "8.8.8.0/24"],
+        "extra": ["104.47.0.0/17"],
+        "covered_by": {
+            "40.92.0.0/15": ["/nsg/securityRules/o365-smtp-40.92.0.0-15"],
+            "40.93.0.0/16": ["/nsg/securityRules/o365-smtp-40.92.0.0-15"],
+            "52.100.0.0/14": ["/nsg/securityRules/partners-smtp"],
+            "8.8.8.0/24": ["o365_Rule_2"]
+        },
+        "denied_by": {
+            "13.107.6.0/24": ["/nsg/securityRules/deny-13.107"]
+        },
+        "uncovered": ["13.107.6.0/24"],
+        "unevaluated_rules": [],
+        "rule_ids":
+        ["/nsg/securityRules/o365-smtp-40.92.0.0-15", "o365_Rule_2"]
+    }]
+
+
+def test_records_are_readable_before_close(tmp_path):
+    path = str(tmp_path / "report.jsonl")
+    writer = JsonLinesReportWriter(path)
+
+    writer.write_result("rgp/nsg-1", "gsuite", {"35.190.247.0/24"}, set(), [])
+
+    with open(path) as report:
+        assert json.loads(report.readline())["nsg"] == "rgp/nsg-1"
+
+    writer.close()
+
+
+def test_gzip_report(tmp_path):
+    path = str(tmp_path / "report.jsonl.gz")
+
+    with JsonLinesReportWriter(path) as writer:
+        writer.write_result("rgp/nsg-1", "o365", set(), set(), [])
+        writer.write_result("rgp/nsg-2", "o365", set(), set(), [])
+
+    with gzip.open(path, "rt") as report:
+        assert [json.loads(line)["nsg"]
+                for line in report] == ["rgp/nsg-1", "rgp/nsg-2"]
+    assert writer.records_written == 2
+
+
+def test_uncovered_cidrs():
+    rules = RULES[:1]
+
+    assert evaluate_access({"8.8.8.0/24"}, rules) == {
+        "covered_by": {},
+        "denied_by": {},
+        "uncovered": ["8.8.8.0/24"],
+        "unevaluated_rules": []
+    }
+
+
+def test_smtp_rules_are_inbound_port_25():
+    assert [rule["name"] for rule in smtp_rules(NSG_RULES)] == [
+        "o365-smtp-40.92.0.0-15", "o365_Rule_2", "partners-smtp",
+        "deny-13.107"
+    ]
+
+
+def test_any_source_covers_every_cidr():
+    rules = [{
+        "id": "any",
+        "direction": "Inbound",
+        "access": "Allow",
+        "destination_port_range": "*",
+        "source_address_prefix": "*"
+    }]
+
+    assert evaluate_access({"8.8.8.0/24"}, rules)["covered_by"] == {
+        "8.8.8.0/24": ["any"]
+    }
+
+
+def test_earlier_deny_blocks_later_allow():
+    rules = [{
+        "id": "allow-any",
+        "priority": 200,
+        "direction": "Inbound",
+        "access": "Allow",
+        "destination_port_range": "*",
+        "source_address_prefix": "*"
+    }, {
+        "id": "deny-40.92",
+        "priority": 100,
+        "direction": "Inbound",
+        "access": "Deny",
+        "destination_port_range": "25",
+        "source_address_prefix": "40.92.0.0/15"
+    }]
+
+    access = evaluate_access({"40.92.0.0/15", "40.92.0.0/14", "8.8.8.0/24"},
+                             rules)
+
+    assert access["covered_by"] == {"8.8.8.0/24": ["allow-any"]}
+    assert access["denied_by"] == {
+        "40.92.0.0/14": ["deny-40.92"],
+        "40.92.0.0/15": ["deny-40.92"]
+    }
+    assert access["uncovered"] == ["40.92.0.0/14", "40.92.0.0/15"]
+
+
+def test_later_deny_does_not_block_earlier_allow():
+    rules = [{
+        "id": "allow-40.92",
+        "priority": 100,
+        "direction": "Inbound",
+        "access": "Allow",
+        "destination_port_range": "25",
+        "source_address_prefix": "40.92.0.0/15"
+    }, {
+        "id": "DenyAllInBound",
+        "priority": 65500,
+        "direction": "Inbound",
+        "access": "Deny",
+        "destination_port_range": "*",
+        "source_address_prefix": "*"
+    }]
+
+    access = evaluate_access({"40.92.1.0/24", "40.94.0.0/16"}, rules)
+
+    assert access["covered_by"] == {"40.92.1.0/24": ["allow-40.92"]}
+    assert access["denied_by"] == {"40.94.0.0/16": ["DenyAllInBound"]}
+
+
+def test_service_tags_are_reported_as_unevaluated():
+    rules = [{
+        "id": "allow-vnet",
+        "priority": 100,
+        "direction": "Inbound",
+        "access": "Allow",
+        "destination_port_range": "*",
+        "source_address_prefix": "VirtualNetwork"
+    }, {
+        "id": "allow-internet",
+        "priority": 200,
+        "direction": "Inbound",
+        "access": "Allow",
+        "destination_port_range": "25",
+        "source_address_prefix": "Internet"
+    }]
+
+    access = evaluate_access({"40.92.0.0/15"}, rules)
+
+    assert access["covered_by"] == {"40.92.0.0/15": ["allow-internet"]}
+    assert access["unevaluated_rules"] == ["allow-vnet"]
+
+
+def test_cidr_covered_by_several_narrower_rules():
+    rules = [{
+        "id": f"allow-40.{octet}",
+        "priority": 100 + octet,
+        "direction": "Inbound",
+        "access": "Allow",
+        "destination_port_range": "25",
+        "source_address_prefix": f"40.{octet}.0.0/16"
+    } for octet in (92, 93)]
+
+    access = evaluate_access({"40.92.0.0/15", "40.92.0.0/14"}, rules)
+
+    assert access["covered_by"] == {
+        "40.92.0.0/15": ["allow-40.92", "allow-40.93"]
+    }
+    assert access["uncovered"] == ["40.92.0.0/14"]